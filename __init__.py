@@ -22,3 +22,5 @@
 
 from . import innubo_controller
 from . import wizard_do_doc
+from . import build_job
+from . import module_doc
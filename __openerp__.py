@@ -30,8 +30,12 @@
         'web'
     ],
     'data': [
+        'security/ir.model.access.csv',
+        'data/dochelp_cron.xml',
         'view/dochelp_menu.xml',
         'view/wizard_do_doc_view.xml',
+        'view/build_job_view.xml',
+        'view/module_doc_view.xml',
     ],
     'demo': [],
     'qweb': [],
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+    dochelp_images
+    --------------
+
+    Lighter images in the HTML builds.
+
+    Every local PNG or JPEG image is replaced by a ``<picture>`` with
+    resized and recompressed variants, WebP ones when Pillow supports
+    them, offered through ``srcset`` so that browsers download the
+    smallest one fitting the page, and loaded lazily.  Variants are cached
+    by content, so unchanged images are never processed again.  Without
+    Pillow the images are left as they are.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import os
+import re
+import shutil
+
+try:
+    from cgi import escape
+except ImportError:
+    from html import escape
+
+from docutils import nodes
+from sphinx.util.osutil import relative_uri
+
+from .optimize import ImageCache, is_optimizable
+
+# folder of the variants in the output folder
+IMAGES_DIR = '_images/opt'
+
+
+class picture(nodes.image):
+    """Optimized image, whose HTML is written beforehand.
+
+    It is still an image, as Sphinx expects one inside image references.
+    """
+
+
+def visit_picture(self, node):
+    self.body.append(node['html'])
+    raise nodes.SkipNode
+
+
+def css_length(value):
+    """Interpret a unitless length as pixels, as the HTML writer does."""
+    if re.match(r'^[0-9.]+$', value):
+        return value + 'px'
+    return value
+
+
+def init_cache(app):
+    app.dochelp_images = None
+    if app.builder.format != 'html' or not app.config.dochelp_images_enabled:
+        return
+    app.dochelp_images = ImageCache(
+        os.path.join(app.doctreedir, 'dochelp_images'),
+        app.config.dochelp_images_widths,
+        quality=app.config.dochelp_images_quality,
+        webp=app.config.dochelp_images_webp)
+
+
+def publish_variant(app, name):
+    """Copy a variant from the cache to the output folder, once."""
+    dest = os.path.join(app.outdir, IMAGES_DIR, name)
+    if not os.path.exists(dest):
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.copyfile(os.path.join(app.dochelp_images.folder, name), dest)
+
+
+def picture_html(app, node, docname, meta):
+    """Return the HTML showing the variants of the image of ``node``."""
+    base = app.builder.get_target_uri(docname)
+
+    def srcset(variants):
+        for name, width in variants:
+            publish_variant(app, name)
+        return ', '.join('%s %dw' % (relative_uri(
+            base, '%s/%s' % (IMAGES_DIR, name)), width)
+            for name, width in variants)
+
+    width = node.get('width') and css_length(node['width'])
+    if width and width.endswith('px'):
+        sizes = width
+    else:
+        sizes = '(max-width: %(width)dpx) 100vw, %(width)dpx' % meta
+    classes = list(node.get('classes', []))
+    if node.get('align'):
+        classes.append('align-%s' % node['align'])
+    attributes = [
+        ('src', relative_uri(base, '%s/%s' % (IMAGES_DIR,
+                                              meta['fallback'][-1][0]))),
+        ('srcset', srcset(meta['fallback'])),
+        ('sizes', sizes),
+        ('alt', node.get('alt', '')),
+        ('width', str(meta['width'])),
+        ('height', str(meta['height'])),
+    ]
+    style = ['%s: %s' % (key, css_length(node[key]))
+             for key in ('width', 'height') if node.get(key)]
+    if style:
+        attributes.append(('style', '; '.join(style)))
+    if classes:
+        attributes.append(('class', ' '.join(classes)))
+    if app.config.dochelp_images_lazy:
+        attributes.extend([('loading', 'lazy'), ('decoding', 'async')])
+    html = ['<picture>']
+    if meta['webp']:
+        html.append('<source type="image/webp" srcset="%s" sizes="%s" />' % (
+            escape(srcset(meta['webp']), True), escape(sizes, True)))
+    html.append('<img %s />' % ' '.join(
+        '%s="%s"' % (key, escape(value, True)) for key, value in attributes))
+    html.append('</picture>')
+    return ''.join(html)
+
+
+def optimize_images(app, doctree, docname):
+    cache = getattr(app, 'dochelp_images', None)
+    if cache is None:
+        return
+    for node in doctree.traverse(nodes.image):
+        uri = node['uri']
+        if '://' in uri or 'scale' in node or not is_optimizable(uri):
+            continue
+        filename = os.path.join(app.srcdir, uri)
+        try:
+            meta = cache.variants(filename)
+        except Exception as exc:
+            app.warn('cannot optimize image %s: %s' % (uri, exc),
+                     (docname, node.line))
+            continue
+        html = picture_html(app, node, docname, meta)
+        # a URI unknown to Sphinx, so that it does not copy the image
+        node.replace_self(picture(uri=html, candidates={'*': html},
+                                  html=html))
+
+
+def save_cache(app, exception):
+    cache = getattr(app, 'dochelp_images', None)
+    if cache is not None and exception is None:
+        cache.save()
+
+
+def setup(app):
+    app.add_config_value('dochelp_images_enabled', True, 'html')
+    app.add_config_value('dochelp_images_widths', [480, 960, 1440], 'html')
+    app.add_config_value('dochelp_images_quality', 85, 'html')
+    app.add_config_value('dochelp_images_webp', True, 'html')
+    app.add_config_value('dochelp_images_lazy', True, 'html')
+    app.add_node(picture, html=(visit_picture, None))
+    app.connect('builder-inited', init_cache)
+    app.connect('doctree-resolved', optimize_images)
+    app.connect('build-finished', save_cache)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+    dochelp_images.optimize
+    -----------------------
+
+    Resized and recompressed variants of the images, cached by content.
+
+    The variants of an image are written once in the cache folder, under
+    a key made of the digest of its content and of the settings, so an
+    image that did not change is never decoded again.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+
+# Formats of the images optimized, by extension
+FORMATS = {
+    '.png': 'PNG',
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+}
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_optimizable(filename):
+    return Image is not None and \
+        os.path.splitext(filename)[1].lower() in FORMATS
+
+
+def _save(image, filename, fmt, quality):
+    tmp = '%s.%d' % (filename, os.getpid())
+    if fmt == 'PNG':
+        image.save(tmp, 'PNG', optimize=True)
+    elif fmt == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(tmp, 'JPEG', quality=quality, optimize=True,
+                   progressive=True)
+    else:
+        # screenshots keep sharp text when PNG ones are losslessly encoded
+        image.save(tmp, 'WEBP', quality=quality, method=4,
+                   lossless=fmt == 'WEBP-LOSSLESS')
+    os.rename(tmp, filename)
+
+
+class ImageCache(object):
+    """Folder of the variants of the images, with the digests of the
+    source files so that they are not read again while unchanged.
+
+    :param widths: widths of the variants, images are never enlarged
+    :param quality: quality of the lossy encodings
+    :param webp: whether WebP variants are written too
+    """
+
+    def __init__(self, folder, widths, quality=85, webp=True):
+        self.folder = folder
+        self.widths = sorted(widths)
+        self.quality = quality
+        self.webp = webp
+        self.settings = hashlib.sha1(repr(
+            (self.widths, quality, webp)).encode('utf-8')).hexdigest()[:8]
+        self._digests_path = os.path.join(folder, 'digests.json')
+        try:
+            with open(self._digests_path) as f:
+                self._digests = json.load(f)
+        except (IOError, OSError, ValueError):
+            self._digests = {}
+
+    def digest(self, filename):
+        """Return the digest of a file, computed once for each version."""
+        stat = os.stat(filename)
+        known = self._digests.get(filename)
+        if known and known[:2] == [stat.st_mtime, stat.st_size]:
+            return known[2]
+        digest = file_digest(filename)
+        self._digests[filename] = [stat.st_mtime, stat.st_size, digest]
+        return digest
+
+    def variants(self, filename):
+        """Return the variants of an image as a dict with the ``width`` and
+        ``height`` of the largest one and, for ``'fallback'`` and
+        ``'webp'``, the list of ``(name, width)`` of the variants in the
+        cache folder."""
+        key = '%s-%s' % (self.digest(filename)[:20], self.settings)
+        meta_path = os.path.join(self.folder, key + '.json')
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        fmt = FORMATS[os.path.splitext(filename)[1].lower()]
+        image = Image.open(filename)
+        image.load()
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            # palette images are resized as true color ones
+            image = image.convert('RGBA')
+        width, height = image.size
+        largest = min(width, self.widths[-1])
+        targets = [w for w in self.widths if w < largest] + [largest]
+        meta = {'width': largest,
+                'height': int(round(height * float(largest) / width)),
+                'fallback': [], 'webp': []}
+        ext = os.path.splitext(filename)[1].lower()
+        webp = self.webp and (fmt == 'PNG' and 'WEBP-LOSSLESS' or 'WEBP')
+        size = os.path.getsize(filename)
+        for target in targets:
+            resized = image
+            if target != width:
+                resized = image.resize(
+                    (target, int(round(height * float(target) / width))),
+                    Image.LANCZOS)
+            name = '%s-%d%s' % (key, target, ext)
+            variant = os.path.join(self.folder, name)
+            _save(resized, variant, fmt, self.quality)
+            if os.path.getsize(variant) < size:
+                meta['fallback'].append((name, target))
+            else:
+                # resizing a screenshot adds colors, so it may compress
+                # worse than the original
+                os.remove(variant)
+            if webp:
+                name = '%s-%d.webp' % (key, target)
+                try:
+                    _save(resized, os.path.join(self.folder, name), webp,
+                          self.quality)
+                except (IOError, KeyError, OSError):
+                    # Pillow built without WebP support
+                    webp = None
+                    meta['webp'] = []
+                else:
+                    meta['webp'].append((name, target))
+        if not meta['fallback'] or meta['fallback'][-1][1] != largest:
+            # the original is the largest fallback
+            name = '%s-%d%s' % (key, width, ext)
+            shutil.copyfile(filename, os.path.join(self.folder, name))
+            meta['fallback'].append((name, width))
+        tmp = '%s.%d' % (meta_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp, meta_path)
+        return meta
+
+    def save(self):
+        """Store the digests of the source files for the next build."""
+        if not os.path.isdir(self.folder):
+            return
+        tmp = '%s.%d' % (self._digests_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self._digests, f)
+        os.rename(tmp, self._digests_path)
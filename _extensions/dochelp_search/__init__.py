@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+    dochelp_search
+    --------------
+
+    Server-side full-text search of the HTML builds.
+
+    Every written document is indexed in :data:`INDEX_FILENAME` of the
+    output folder, with the stemmer Sphinx uses for the language of the
+    build, so that the server answers queries without the browser
+    downloading the whole ``searchindex.js``.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import os
+from collections import Counter
+
+from docutils import nodes
+from sphinx.search import SearchLanguage, languages
+
+from .index import IndexWriter, SearchIndex, merge_indexes
+
+INDEX_FILENAME = '_searchindex.sqlite'
+# index kept up to date between builds, in the doctree folder
+WRITER_FILENAME = 'search.sqlite'
+
+# characters of the text of a document returned with the results
+SUMMARY_LENGTH = 200
+
+# nodes whose text is not shown to the reader
+_skipped_nodes = (nodes.comment, nodes.raw, nodes.substitution_definition,
+                  nodes.system_message)
+
+
+class Analyzer(object):
+    """Splits a text into the stemmed terms of the index."""
+
+    def __init__(self, lang, options=None):
+        lang_class = languages.get(lang) or SearchLanguage
+        if not isinstance(lang_class, type):
+            # newer versions of Sphinx give the dotted name of the class
+            module, name = lang_class.rsplit('.', 1)
+            lang_class = getattr(__import__(module, fromlist=[name]), name)
+        self.search_language = lang_class(options or {})
+
+    def terms(self, text):
+        for word in self.search_language.split(text):
+            term = self.search_language.stem(word.lower())
+            if self.search_language.word_filter(term):
+                yield term
+
+
+def open_index(path):
+    """Return the reader of the index published in ``path``."""
+    return SearchIndex(path, Analyzer)
+
+
+def collect_text(doctree):
+    """Return the text of the body and of the titles of a document."""
+    body = []
+    titles = []
+    for node in doctree.traverse(nodes.Text):
+        if node.parent is None or isinstance(node.parent, _skipped_nodes):
+            continue
+        if isinstance(node.parent, nodes.title):
+            titles.append(node.astext())
+        else:
+            body.append(node.astext())
+    return ' '.join(body), ' '.join(titles)
+
+
+def init_index(app):
+    app.dochelp_search_index = None
+    app.dochelp_search_analyzer = None
+    if app.builder.format != 'html':
+        return
+    app.dochelp_search_lang = app.config.language or 'en'
+    app.dochelp_search_analyzer = Analyzer(app.dochelp_search_lang,
+                                           app.config.html_search_options)
+
+
+def index_missing(app, env, added, changed, removed):
+    """Open the index of the build, and read again every document when it
+    is empty, as the documents that are up to date would not be indexed
+    otherwise."""
+    analyzer = getattr(app, 'dochelp_search_analyzer', None)
+    if analyzer is None:
+        return []
+    # opened by every build, as the builds of an application may run in
+    # different threads
+    index = app.dochelp_search_index = IndexWriter(
+        os.path.join(app.doctreedir, WRITER_FILENAME),
+        app.dochelp_search_lang)
+    if index.is_empty():
+        return list(env.found_docs - added - changed)
+    return []
+
+
+def index_document(app, doctree, docname):
+    index = getattr(app, 'dochelp_search_index', None)
+    if index is None:
+        return
+    analyzer = app.dochelp_search_analyzer
+    body, titles = collect_text(doctree)
+    title = app.env.titles.get(docname)
+    index.add_document(
+        docname, app.builder.get_target_uri(docname),
+        title and title.astext() or docname,
+        ' '.join(body.split())[:SUMMARY_LENGTH],
+        Counter(analyzer.terms(body)), Counter(analyzer.terms(titles)))
+
+
+def publish_index(app, exception):
+    index = getattr(app, 'dochelp_search_index', None)
+    if index is None:
+        return
+    app.dochelp_search_index = None
+    try:
+        if exception is not None:
+            index.rollback()
+            return
+        index.prune(app.env.found_docs)
+        index.publish(os.path.join(app.outdir, INDEX_FILENAME))
+    finally:
+        index.close()
+
+
+def setup(app):
+    app.connect('builder-inited', init_index)
+    app.connect('env-get-outdated', index_missing)
+    app.connect('doctree-resolved', index_document)
+    app.connect('build-finished', publish_index)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+    dochelp_search.index
+    --------------------
+
+    On-disk inverted index of the built documents.
+
+    The index is a SQLite database holding, for every term, the documents
+    it appears in.  Looking a query up only reads the postings of its
+    terms, so it does not depend on the number of indexed documents.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import math
+import os
+import shutil
+import sqlite3
+import threading
+
+# parameters of the Okapi BM25 ranking
+BM25_K1 = 1.2
+BM25_B = 0.75
+# a term found in a title counts as this many occurrences
+TITLE_WEIGHT = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    docname TEXT UNIQUE NOT NULL,
+    uri TEXT NOT NULL,
+    title TEXT,
+    summary TEXT,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    title_tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+"""
+
+
+def write_stats(conn, lang=None):
+    """Store the statistics of the documents needed by the ranking."""
+    count, total = conn.execute(
+        'SELECT COUNT(*), SUM(length) FROM docs').fetchone()
+    meta = [('doc_count', str(count)),
+            ('avg_length', str(float(total or 0) / (count or 1)))]
+    if lang:
+        meta.append(('lang', lang))
+    conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', meta)
+    conn.commit()
+
+
+def merge_indexes(dest, sources):
+    """Atomically replace ``dest`` with an index of the documents of
+    several ones.
+
+    :param sources: ``(prefix, path)`` of each index, ``prefix`` being
+        prepended to the names and URIs of its documents
+    """
+    tmp = '%s.%d' % (dest, os.getpid())
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.executescript(SCHEMA)
+        lang = None
+        for prefix, path in sources:
+            if not os.path.isfile(path):
+                continue
+            conn.execute('ATTACH DATABASE ? AS source', (path,))
+            row = conn.execute(
+                "SELECT value FROM source.meta WHERE key = 'lang'").fetchone()
+            lang = lang or row and row[0]
+            offset = conn.execute(
+                'SELECT COALESCE(MAX(id), 0) FROM docs').fetchone()[0]
+            conn.execute(
+                'INSERT INTO docs SELECT id + ?, ? || docname, ? || uri, '
+                'title, summary, length FROM source.docs',
+                (offset, prefix, prefix))
+            conn.execute(
+                'INSERT INTO postings SELECT term, doc_id + ?, tf, title_tf '
+                'FROM source.postings', (offset,))
+            conn.commit()
+            conn.execute('DETACH DATABASE source')
+        write_stats(conn, lang)
+    finally:
+        conn.close()
+    os.rename(tmp, dest)
+
+
+class IndexWriter(object):
+    """Incrementally maintained index of the documents of a build.
+
+    The index lives next to the doctrees so that only the documents written
+    by a build are indexed again, and is copied to the output folder once
+    the build finished.
+    """
+
+    def __init__(self, path, lang):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.executescript(SCHEMA)
+        if self._meta('lang') != lang:
+            # the terms were stemmed for another language
+            with self._conn:
+                self._conn.execute('DELETE FROM postings')
+                self._conn.execute('DELETE FROM docs')
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                    ('lang', lang))
+
+    def _meta(self, key):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?',
+                                 (key,)).fetchone()
+        return row and row[0]
+
+    def is_empty(self):
+        return self._conn.execute(
+            'SELECT COUNT(*) FROM docs').fetchone()[0] == 0
+
+    def add_document(self, docname, uri, title, summary, terms,
+                     title_terms):
+        """Index a document, replacing its previous version.
+
+        :param dict terms: occurrences of each term in the body
+        :param dict title_terms: occurrences of each term in the titles
+        """
+        self.remove_document(docname)
+        cursor = self._conn.execute(
+            'INSERT INTO docs (docname, uri, title, summary, length) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (docname, uri, title, summary,
+             sum(terms.values()) + sum(title_terms.values())))
+        doc_id = cursor.lastrowid
+        self._conn.executemany(
+            'INSERT INTO postings VALUES (?, ?, ?, ?)',
+            [(term, doc_id, terms.get(term, 0), title_terms.get(term, 0))
+             for term in set(terms) | set(title_terms)])
+
+    def remove_document(self, docname):
+        row = self._conn.execute('SELECT id FROM docs WHERE docname = ?',
+                                 (docname,)).fetchone()
+        if row:
+            self._conn.execute('DELETE FROM postings WHERE doc_id = ?', row)
+            self._conn.execute('DELETE FROM docs WHERE id = ?', row)
+
+    def prune(self, docnames):
+        """Remove the documents not in ``docnames``."""
+        indexed = [row[0] for row in
+                   self._conn.execute('SELECT docname FROM docs')]
+        for docname in set(indexed) - set(docnames):
+            self.remove_document(docname)
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def publish(self, dest):
+        """Commit the changes and atomically replace ``dest`` with a copy
+        of the index, so that readers never see a partial one."""
+        write_stats(self._conn)
+        tmp = '%s.%d' % (dest, os.getpid())
+        shutil.copyfile(self.path, tmp)
+        os.rename(tmp, dest)
+
+    def close(self):
+        self._conn.close()
+
+
+class SearchIndex(object):
+    """Read-only access to a published index.
+
+    The database is memory-mapped and reopened when a build replaces it.
+
+    :param path: file of the index
+    :param analyzer_factory: callable returning, for the language of the
+        index, the analyzer splitting a query into terms
+    """
+
+    mmap_size = 64 * 1024 * 1024
+
+    def __init__(self, path, analyzer_factory):
+        self.path = path
+        self.analyzer_factory = analyzer_factory
+        self._lock = threading.Lock()
+        self._conn = None
+        self._stat = None
+
+    def _open(self):
+        stat = os.stat(self.path)
+        stat = (stat.st_ino, stat.st_mtime)
+        if stat != self._stat:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA query_only = ON')
+            self._conn.execute('PRAGMA mmap_size = %d' % self.mmap_size)
+            meta = dict(self._conn.execute('SELECT key, value FROM meta'))
+            self.doc_count = int(meta.get('doc_count') or 0)
+            self.avg_length = float(meta.get('avg_length') or 1)
+            self.analyzer = self.analyzer_factory(meta.get('lang'))
+            self._stat = stat
+        return self._conn
+
+    def search(self, query, limit=20):
+        """Return the documents best matching ``query``, as dicts with
+        their ``docname``, ``uri``, ``title``, ``summary`` and ``score``."""
+        with self._lock:
+            conn = self._open()
+            terms = set(self.analyzer.terms(query))
+            if not terms:
+                return []
+            postings = {}
+            for term in terms:
+                postings[term] = conn.execute(
+                    'SELECT p.doc_id, p.tf + ? * p.title_tf, d.length '
+                    'FROM postings p JOIN docs d ON d.id = p.doc_id '
+                    'WHERE p.term = ?', (TITLE_WEIGHT, term)).fetchall()
+            scores = {}
+            for term, rows in postings.items():
+                df = len(rows)
+                idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+                for doc_id, tf, length in rows:
+                    norm = 1 - BM25_B + BM25_B * length / self.avg_length
+                    scores[doc_id] = scores.get(doc_id, 0) + idf * \
+                        tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+            best = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+            docs = {}
+            if best:
+                ids = [doc_id for doc_id, score in best]
+                docs = dict((row[0], row[1:]) for row in conn.execute(
+                    'SELECT id, docname, uri, title, summary FROM docs '
+                    'WHERE id IN (%s)' % ','.join('?' * len(ids)), ids))
+            return [{
+                'docname': docs[doc_id][0],
+                'uri': docs[doc_id][1],
+                'title': docs[doc_id][2],
+                'summary': docs[doc_id][3],
+                'score': score,
+            } for doc_id, score in best]
@@ -10,12 +10,95 @@
             :height: 315
             :width: 560
             :align: left
+    In HTML builds the players are replaced by facades: the thumbnail of
+    the video, fetched and cached at build time, or a placeholder when it
+    cannot be fetched, and the player is only loaded once clicked.  The
+    ``embedded_video_facade`` configuration value set to False embeds the
+    players instead, and ``embedded_video_thumbnails`` set to False never
+    fetches thumbnails.
     :copyright: (c) 2012 by Danilo Bargen.
     :license: BSD 3-clause
 """
 from __future__ import absolute_import
+import json
+import os
+import re
+import shutil
+import time
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
 from docutils import nodes
 from docutils.parsers.rst import Directive, directives
+from sphinx.util.osutil import relative_uri
+
+# seconds to wait for a thumbnail
+THUMBNAIL_TIMEOUT = 5
+# seconds before trying again to fetch a thumbnail that could not be
+THUMBNAIL_RETRY = 24 * 3600
+# folder of the thumbnails in the output folder
+THUMBNAILS_DIR = '_images/video'
+
+FACADE_HTML = '<div class="video-facade align-%(align)s" \
+data-src="%(embed_url)s" data-width="%(width)u" data-height="%(height)u" \
+style="width: %(width)upx; height: %(height)upx" role="button" \
+tabindex="0" aria-label="Play video">%(thumbnail)s\
+<span class="video-facade-play"></span></div>'
+
+THUMBNAIL_HTML = '<img src="%(src)s" alt="" width="%(width)u" \
+height="%(height)u" loading="lazy" decoding="async" />'
+
+# written once in every page showing facades
+FACADE_ASSETS = '''<style>
+.video-facade{position:relative;display:inline-block;overflow:hidden;\
+cursor:pointer;background:#222}
+.video-facade img{display:block;width:100%;height:100%;object-fit:cover}
+.video-facade-play{position:absolute;left:50%;top:50%;width:68px;\
+height:48px;margin:-24px 0 0 -34px;border-radius:12px;\
+background:rgba(0,0,0,.7)}
+.video-facade:hover .video-facade-play,\
+.video-facade:focus .video-facade-play{background:#e00}
+.video-facade-play:after{content:"";position:absolute;left:27px;top:14px;\
+border-style:solid;border-width:10px 0 10px 18px;\
+border-color:transparent transparent transparent #fff}
+</style>
+<script>
+(function () {
+    if (window.videoFacades) {
+        return;
+    }
+    window.videoFacades = true;
+    function play(event) {
+        var facade = event.target;
+        while (facade && !/\\bvideo-facade\\b/.test(facade.className || '')) {
+            facade = facade.parentNode;
+        }
+        if (!facade || (event.type === 'keydown' &&
+                        event.keyCode !== 13 && event.keyCode !== 32)) {
+            return;
+        }
+        event.preventDefault();
+        var iframe = document.createElement('iframe');
+        iframe.src = facade.getAttribute('data-src');
+        iframe.width = facade.getAttribute('data-width');
+        iframe.height = facade.getAttribute('data-height');
+        iframe.className = facade.className.replace('video-facade', '');
+        iframe.setAttribute('frameborder', '0');
+        iframe.setAttribute('allow', 'autoplay; fullscreen');
+        iframe.setAttribute('allowfullscreen', '');
+        facade.parentNode.replaceChild(iframe, facade);
+    }
+    document.addEventListener('click', play);
+    document.addEventListener('keydown', play);
+})();
+</script>'''
+
+
+class video_facade(nodes.General, nodes.Element):
+    """A video shown as a facade in HTML builds."""
 
 
 def align(argument):
@@ -44,23 +127,119 @@ class IframeVideo(Directive):
             self.options['height'] = self.default_height
         if not self.options.get('align'):
             self.options['align'] = 'left'
+        env = getattr(self.state.document.settings, 'env', None)
+        if env is not None and env.config.embedded_video_facade:
+            return [video_facade(provider=self.name, **self.options)]
         return [nodes.raw('', self.html % self.options, format='html')]
 
+    @classmethod
+    def embed_url(cls, video_id):
+        return cls.embed % video_id
+
+    @classmethod
+    def thumbnail_url(cls, video_id):
+        """Return the URL of the thumbnail of a video."""
+        raise NotImplementedError()
+
 
 class Youtube(IframeVideo):
     html = '<iframe src="https://www.youtube.com/embed/%(video_id)s" \
     width="%(width)u" height="%(height)u" frameborder="0" \
     webkitAllowFullScreen mozallowfullscreen allowfullscreen \
-    class="align-%(align)s"></iframe>'
+    loading="lazy" class="align-%(align)s"></iframe>'
+    embed = 'https://www.youtube.com/embed/%s?autoplay=1'
+
+    @classmethod
+    def thumbnail_url(cls, video_id):
+        return 'https://i.ytimg.com/vi/%s/hqdefault.jpg' % video_id
 
 
 class Vimeo(IframeVideo):
     html = '<iframe src="https://player.vimeo.com/video/%(video_id)s" \
     width="%(width)u" height="%(height)u" frameborder="0" \
     webkitAllowFullScreen mozallowfullscreen allowFullScreen \
-    class="align-%(align)s"></iframe>'
+    loading="lazy" class="align-%(align)s"></iframe>'
+    embed = 'https://player.vimeo.com/video/%s?autoplay=1'
+
+    @classmethod
+    def thumbnail_url(cls, video_id):
+        response = urlopen('https://vimeo.com/api/oembed.json?url='
+                           'https://vimeo.com/%s' % video_id,
+                           timeout=THUMBNAIL_TIMEOUT)
+        return json.loads(response.read().decode('utf-8'))['thumbnail_url']
+
+
+PROVIDERS = {
+    'youtube': Youtube,
+    'vimeo': Vimeo,
+}
+
+
+def fetch_thumbnail(folder, provider, video_id):
+    """Return the thumbnail of a video cached in ``folder``, fetching it
+    when missing, or None when it cannot be fetched."""
+    name = '%s-%s.jpg' % (provider, re.sub(r'[^\w-]', '_', video_id))
+    filename = os.path.join(folder, name)
+    if os.path.exists(filename):
+        return filename
+    failed = filename + '.failed'
+    if os.path.exists(failed) and \
+            os.path.getmtime(failed) > time.time() - THUMBNAIL_RETRY:
+        return None
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    try:
+        url = PROVIDERS[provider].thumbnail_url(video_id)
+        data = urlopen(url, timeout=THUMBNAIL_TIMEOUT).read()
+    except Exception:
+        # offline builds show a placeholder
+        open(failed, 'w').close()
+        return None
+    tmp = '%s.%d' % (filename, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, filename)
+    return filename
+
+
+def render_facades(app, doctree, docname):
+    """Replace the facades of a document by their HTML, or drop them from
+    the builds without HTML."""
+    facades = list(doctree.traverse(video_facade))
+    if not facades:
+        return
+    if app.builder.format != 'html':
+        for node in facades:
+            node.parent.remove(node)
+        return
+    folder = os.path.join(app.doctreedir, 'embedded_video')
+    base = app.builder.get_target_uri(docname)
+    for index, node in enumerate(facades):
+        values = dict(node.attributes)
+        provider = PROVIDERS[node['provider']]
+        values['embed_url'] = provider.embed_url(node['video_id'])
+        values['thumbnail'] = ''
+        thumbnail = app.config.embedded_video_thumbnails and \
+            fetch_thumbnail(folder, node['provider'], node['video_id'])
+        if thumbnail:
+            name = '%s/%s' % (THUMBNAILS_DIR, os.path.basename(thumbnail))
+            dest = os.path.join(app.outdir, name)
+            if not os.path.exists(dest):
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                shutil.copyfile(thumbnail, dest)
+            values['thumbnail'] = THUMBNAIL_HTML % dict(
+                values, src=relative_uri(base, name))
+        html = FACADE_HTML % values
+        if index == 0:
+            html = FACADE_ASSETS + html
+        node.replace_self(nodes.raw('', html, format='html'))
 
 
 def setup(builder):
+    builder.add_config_value('embedded_video_facade', True, 'env')
+    builder.add_config_value('embedded_video_thumbnails', True, 'html')
+    builder.add_node(video_facade)
+    builder.connect('doctree-resolved', render_facades)
     directives.register_directive('youtube', Youtube)
-    directives.register_directive('vimeo', Vimeo)
\ No newline at end of file
+    directives.register_directive('vimeo', Vimeo)
@@ -9,35 +9,435 @@ from __future__ import print_function
     :license: BSD, see LICENSE for details.
 """
 
+import codecs
+import hashlib
+import json
+import os
 import re
 from collections import OrderedDict
 from docutils import nodes
 from docutils.parsers.rst import directives
 from docutils.transforms import Transform
+from sphinx.errors import ConfigError
 from sphinx.util.compat import Directive
 from sphinx import roles
 
-import erppeek
+from .backends import Backend, CacheBackend, EnvBackend, ErppeekBackend
+from .cache import MetadataCache
+from .lookup import LOOKUP_FILENAME, build_lookup, lookup_key, write_lookup
+from .profiling import PROFILE_FILENAME, BuildProfile, profiled
+
+# application of the running build; several applications may be kept
+# alive in a process, each one is activated when its build starts
+_app = None
+# metadata backend of the running build, created on first use
+_backend = None
+# persistent metadata cache of the running build and signature of the
+# installed modules
+_cache = None
+_signature = None
+# fields_get() result of every model used in the build, by (lang, model)
+_model_fields = {}
+# name and complete name of every menu used in the build, by (lang, xmlid)
+_menus = {}
+# description of every model used in the build, by (lang, model)
+_model_names = {}
+# timings and counters of the running build
+_profile = BuildProfile()
+
+DEFAULT_PATTERN = re.compile(r'@(.|[^@]+)@')
+
+_directive_re = re.compile(r'^\s*\.\.\s+(field|fields|menu|model)::\s*(\S+)',
+                           re.MULTILINE)
+_role_re = re.compile(r':odoo(field|menu):`([^`]+)`')
+
+
+def scan_references(text, pattern):
+    """Return the set of ``(kind, content)`` Odoo references in a source.
+
+    Plain text references, directives and roles are all reported, e.g.
+    ``('field', 'res.partner/name')`` or ``('fields', 'res.partner')``.
+    """
+    if isinstance(pattern, basestring):
+        pattern = re.compile(pattern)
+    refs = set()
+    for match in pattern.finditer(text):
+        data = match.group(1).split(':')
+        if len(data) > 1:
+            refs.add((data[0], data[1]))
+    for regex in (_directive_re, _role_re):
+        for match in regex.finditer(text):
+            refs.add((match.group(1), match.group(2)))
+    return refs
+
+
+def get_profile():
+    return _profile
 
-_client = None
 
+def create_backend(config):
+    """Return the metadata backend selected by ``odoodoc_backend``.
 
+    The option is either ``'erppeek'``, ``'cache'`` or a callable taking
+    the Sphinx application and returning a :class:`Backend`, which is how a
+    build running inside Odoo plugs in an :class:`EnvBackend`.
+    """
+    backend = config.odoodoc_backend
+    if callable(backend):
+        return backend(_app)
+    if backend == 'erppeek':
+        return ErppeekBackend(config.odoo_server, config.odoo_db,
+                              config.odoo_user, config.odoo_pwd,
+                              timeout=config.odoodoc_rpc_timeout,
+                              retries=config.odoodoc_rpc_retries,
+                              threads=config.odoodoc_rpc_threads)
+    if backend == 'cache':
+        if not config.odoodoc_cache_path or not config.odoodoc_cache_signature:
+            raise ConfigError('The cache odoodoc_backend needs both '
+                              'odoodoc_cache_path and odoodoc_cache_signature')
+        return CacheBackend(config.odoodoc_cache_signature)
+    raise ConfigError('Unknown odoodoc_backend %r' % (backend,))
+
+
+def get_backend():
+    global _backend, _signature
+    if _backend is None:
+        _backend = create_backend(_app.config)
+        if _cache is not None:
+            with _profile.timed('backend:registry_signature'):
+                _signature = _backend.registry_signature()
+    return _backend
+
+
+def cached(kind, key, odoo_lang, fetch):
+    """Return the metadata of ``key`` from the persistent cache, calling
+    ``fetch`` to get it from the server on a miss.
+
+    Errors raised by ``fetch`` are propagated and nothing is stored.
+    """
+    if _cache is None:
+        with _profile.timed('backend:%s' % kind):
+            return fetch()
+    get_backend()
+    found, value = _cache.get(kind, key, odoo_lang, _signature)
+    if not found:
+        with _profile.timed('backend:%s' % kind):
+            value = fetch()
+        _cache.set(kind, key, odoo_lang, _signature, value)
+    return value
+
+
+def cached_many(kind, keys, odoo_lang, fetch_many):
+    """Return a dict with the metadata of every key in ``keys``, calling
+    ``fetch_many`` once with all the keys missing from the persistent
+    cache.
+    """
+    res = {}
+    missing = list(keys)
+    if _cache is not None:
+        get_backend()
+        missing = []
+        for key in keys:
+            found, value = _cache.get(kind, key, odoo_lang, _signature)
+            if found:
+                res[key] = value
+            else:
+                missing.append(key)
+    if missing:
+        with _profile.timed('backend:%s' % kind):
+            fetched = fetch_many(missing)
+        if _cache is not None:
+            _cache.set_many(kind, odoo_lang, _signature, fetched)
+        res.update(fetched)
+    return res
+
+
+def get_model_fields(model_name, odoo_lang):
+    """Return the fields_get() description of all fields of a model.
+
+    The server is asked only once per model and language in a build.
+    """
+    key = (odoo_lang, model_name)
+    if key not in _model_fields:
+        try:
+            _model_fields[key] = cached(
+                'fields', model_name, odoo_lang,
+                lambda: get_backend().fields_get(model_name, odoo_lang))
+        except:
+            _model_fields[key] = None
+    return _model_fields[key]
+
+
+@profiled(get_profile)
+def prefetch_metadata(models, menus, model_names, odoo_lang):
+    """Fetch in batches the metadata not known yet of several models,
+    menus and model descriptions.
+
+    Whatever cannot be fetched here is left unknown, to be fetched again
+    on its own when used.
+    """
+    missing = sorted(m for m in models if (odoo_lang, m) not in _model_fields)
+    if missing:
+        try:
+            fetched = cached_many('fields', missing, odoo_lang,
+                                  lambda keys: get_backend().fields_get_many(
+                                      keys, odoo_lang))
+        except Exception:
+            fetched = {}
+        for model_name, value in fetched.items():
+            _model_fields[(odoo_lang, model_name)] = value
+    if menus:
+        get_menus(sorted(menus), odoo_lang)
+    missing = sorted(m for m in model_names
+                     if (odoo_lang, m) not in _model_names)
+    if missing:
+        try:
+            fetched = cached_many('model', missing, odoo_lang,
+                                  lambda keys: get_backend().model_names(
+                                      keys, odoo_lang))
+        except Exception:
+            fetched = {}
+        for model_name, value in fetched.items():
+            _model_names[(odoo_lang, model_name)] = value
+
+
+@profiled(get_profile)
 def get_field_data(model_name, field_name, show_help, odoo_lang):
-    global _client
     if show_help:
         key = 'help'
     else:
         key = 'string'
-    ctx = {'lang': odoo_lang}
+    model_fields = get_model_fields(model_name, odoo_lang) or {}
+    return model_fields.get(field_name, {}).get(key)
+
+
+def note_dependency(env, dep, value):
+    """Record that the document being read rendered ``value`` for the
+    metadata lookup ``dep``, e.g. ``('field', model, field, show_help)``.
+    """
+    if not hasattr(env, 'odoodoc_dependencies'):
+        env.odoodoc_dependencies = {}
+    env.odoodoc_dependencies.setdefault(env.docname, {})[dep] = value
+
+
+def resolve_dependency(dep, odoo_lang):
+    kind = dep[0]
+    try:
+        if kind == 'field':
+            return get_field_data(dep[1], dep[2], dep[3], odoo_lang)
+        elif kind == 'menu':
+            return get_menu_data(dep[1], dep[2], dep[3], odoo_lang)
+        elif kind == 'model':
+            return get_model_data(dep[1], odoo_lang)
+        elif kind == 'fields':
+            return field_list_signature(
+                get_field_list(dep[1], dep[2], odoo_lang))
+    except Exception:
+        return None
+
+
+def purge_dependencies(app, env, docname):
+    getattr(env, 'odoodoc_dependencies', {}).pop(docname, None)
+    getattr(env, 'odoodoc_lookup', {}).pop(docname, None)
+
+
+def mark_reference(node, kind, *parts):
+    """Mark ``node`` as documenting a model, a field or a menu, for the
+    context-sensitive help lookup table."""
+    node.setdefault('odoodoc_refs', []).append(
+        (kind, lookup_key(kind, *parts)))
+    return node
+
+
+def section_anchor(node):
+    """Return the anchor of the section containing ``node``, empty for the
+    top of the document, and whether ``node`` is in its title."""
+    in_title = False
+    while node is not None and not isinstance(node, nodes.section):
+        in_title = in_title or isinstance(node, nodes.title)
+        node = node.parent
+    if node is None or isinstance(node.parent, nodes.document) or \
+            not node['ids']:
+        return '', in_title
+    return node['ids'][0], in_title
+
+
+def start_document(app, docname, source):
+    _profile.start_document(docname)
+
+
+def stop_document(app, doctree):
+    _profile.stop_document(app.env.docname)
+
+
+def start_writing(app, env):
+    _profile.stop('read')
+    _profile.start('write')
+
+
+def record_references(app, doctree):
+    """Remember the sections of the document just read documenting each
+    model, field and menu."""
+    env = app.env
+    refs = []
+    for node in doctree.traverse(nodes.Element):
+        if not node.get('odoodoc_refs'):
+            continue
+        anchor, in_title = section_anchor(node)
+        for kind, key in node['odoodoc_refs']:
+            refs.append((kind, key, anchor, in_title))
+    if not hasattr(env, 'odoodoc_lookup'):
+        env.odoodoc_lookup = {}
+    env.odoodoc_lookup[env.docname] = refs
+
+
+def write_lookup_table(app, exception):
+    if exception is not None or app.builder.format != 'html':
+        return
+    lookup = build_lookup(getattr(app.env, 'odoodoc_lookup', {}),
+                          app.builder.get_target_uri)
+    write_lookup(lookup, os.path.join(app.outdir, LOOKUP_FILENAME))
+
+
+def outdated_dependencies(app, env, added, changed, removed):
+    """Return the documents whose Odoo metadata changed since they were
+    read, so that they are read and written again."""
+    # first event of every build
+    activate(app)
+    _profile.start('outdated')
+    if not hasattr(env, 'odoodoc_lookup'):
+        # read by a version not recording the lookup table yet
+        return list(env.found_docs - added - changed)
+    lang = app.config.odoo_lang
+    dependencies = dict(
+        (docname, deps)
+        for docname, deps in getattr(env, 'odoodoc_dependencies', {}).items()
+        if docname not in changed and docname not in removed)
+    models = set()
+    menus = set()
+    model_names = set()
+    for deps in dependencies.values():
+        for dep in deps:
+            if dep[0] in ('field', 'fields'):
+                models.add(dep[1])
+            elif dep[0] == 'menu':
+                menus.add('%s.%s' % (dep[1], dep[2]))
+            elif dep[0] == 'model':
+                model_names.add(dep[1])
+    prefetch_metadata(models, menus, model_names, lang)
+    return [docname for docname, deps in dependencies.items()
+            if any(resolve_dependency(dep, lang) != value
+                   for dep, value in deps.items())]
+
+
+def referenced_metadata(filenames, pattern, encoding):
+    """Return the models whose fields, the menu xmlids and the models
+    whose description are referenced by some source files."""
+    models = set()
+    menus = set()
+    model_names = set()
+    for filename in filenames:
+        try:
+            with codecs.open(filename, 'r', encoding) as f:
+                text = f.read()
+        except (IOError, OSError, UnicodeError):
+            continue
+        for kind, content in scan_references(text, pattern):
+            if kind == 'field' and '/' in content:
+                models.add(content.split('/')[0])
+            elif kind == 'fields':
+                models.add(content)
+            elif kind == 'menu' and '/' in content:
+                menus.add(content.replace('/', '.', 1))
+            elif kind == 'model':
+                model_names.add(content)
+    return models, menus, model_names
+
+
+def prefetch_references(app, env, docnames):
+    """Fetch the metadata of every model referenced by the documents to
+    be read, so that each model costs a single fields_get() call.
+    """
+    _profile.stop('outdated')
+    _profile.start('read')
+    config = app.config
+    models, menus, model_names = referenced_metadata(
+        [env.doc2path(docname) for docname in docnames],
+        config.odoodoc_pattern, config.source_encoding)
+    prefetch_metadata(models, menus, model_names, config.odoo_lang)
+
+
+def source_files(srcdir, source_suffix='.rst'):
+    """Return the source files of ``srcdir``."""
+    filenames = []
+    for dirpath, dirnames, files in os.walk(srcdir, followlinks=True):
+        filenames.extend(os.path.join(dirpath, f) for f in files
+                         if f.endswith(source_suffix))
+    return filenames
+
+
+def warm_cache(backend, cache_path, srcdir, odoo_lang,
+               pattern=DEFAULT_PATTERN, source_suffix='.rst',
+               encoding='utf-8-sig'):
+    """Store in the persistent cache the metadata referenced by all the
+    sources of ``srcdir``, as read from ``backend``.
+
+    This lets builds that cannot reach Odoo run with the ``'cache'``
+    backend.  Return the registry signature the entries are stored under,
+    the value of ``odoodoc_cache_signature`` for those builds.
+    """
+    models, menus, model_names = referenced_metadata(
+        source_files(srcdir, source_suffix), pattern, encoding)
+    cache = MetadataCache(cache_path)
+    try:
+        signature = backend.registry_signature()
+        missing = [
+            model_name for model_name in sorted(models)
+            if not cache.get('fields', model_name, odoo_lang, signature)[0]]
+        if missing:
+            cache.set_many('fields', odoo_lang, signature,
+                           backend.fields_get_many(missing, odoo_lang))
+        missing = [xmlid for xmlid in sorted(menus)
+                   if not cache.get('menu', xmlid, odoo_lang, signature)[0]]
+        if missing:
+            cache.set_many('menu', odoo_lang, signature,
+                           backend.read_menus(missing, odoo_lang))
+        missing = [
+            model_name for model_name in sorted(model_names)
+            if not cache.get('model', model_name, odoo_lang, signature)[0]]
+        if missing:
+            cache.set_many('model', odoo_lang, signature,
+                           backend.model_names(missing, odoo_lang))
+        cache.flush()
+    finally:
+        cache.close()
+    return signature
+
+
+def metadata_digest(cache_path, srcdir, odoo_lang, signature,
+                    pattern=DEFAULT_PATTERN, source_suffix='.rst',
+                    encoding='utf-8-sig'):
+    """Return a digest of the metadata referenced by all the sources of
+    ``srcdir``, as stored in the persistent cache by :func:`warm_cache`
+    under ``signature``.
+
+    It changes whenever a build of the sources could, which the installed
+    modules alone do not tell, as translations and menus are data.
+    """
+    models, menus, model_names = referenced_metadata(
+        source_files(srcdir, source_suffix), pattern, encoding)
+    cache = MetadataCache(cache_path)
+    digest = hashlib.sha1()
     try:
-        xname = _client.execute(
-            model_name,
-            'fields_get',
-            field_name,
-            context=ctx)[field_name][key]
-    except:
-        xname = None
-    return xname
+        for kind, keys in (('fields', models), ('menu', menus),
+                           ('model', model_names)):
+            for key in sorted(keys):
+                found, value = cache.get(kind, key, odoo_lang, signature)
+                digest.update(json.dumps([kind, key, value],
+                                         sort_keys=True).encode('utf-8'))
+    finally:
+        cache.close()
+    return digest.hexdigest()
 
 
 class FieldDirective(Directive):
@@ -51,7 +451,8 @@ class FieldDirective(Directive):
     }
 
     def run(self):
-        config = self.state.document.settings.env.config
+        env = self.state.document.settings.env
+        config = env.config
         content = self.arguments[0]
         if 'help' in self.options:
             show_help = True
@@ -64,26 +465,42 @@ class FieldDirective(Directive):
 
         model_name, field_name = content.split('/')
 
+        _profile.count('directive:field')
         text = get_field_data(model_name, field_name, show_help, config.odoo_lang)
+        note_dependency(env, ('field', model_name, field_name, show_help), text)
         if text is None:
             return [self.state_machine.reporter.warning(
                 'Model/Field "%s" not found.' % content, line=self.lineno)]
-        return [nodes.literal(text=text, classes=classes)]
-
-
+        return [mark_reference(nodes.literal(text=text, classes=classes),
+                               'field', model_name, field_name)]
+
+
+def get_menus(xmlids, odoo_lang):
+    """Return the metadata of several menus, fetching the ones not known
+    yet in one go."""
+    missing = [x for x in xmlids if (odoo_lang, x) not in _menus]
+    if missing:
+        try:
+            fetched = cached_many('menu', missing, odoo_lang,
+                                  lambda keys: get_backend().read_menus(
+                                      keys, odoo_lang))
+        except:
+            fetched = dict.fromkeys(missing)
+        for xmlid, value in fetched.items():
+            _menus[(odoo_lang, xmlid)] = value
+    return dict((x, _menus[(odoo_lang, x)]) for x in xmlids)
+
+
+@profiled(get_profile)
 def get_menu_data(module_name, menu_name, show_name_only, odoo_lang):
-    o = _client.IrModelData.read([
-        ('module', '=', module_name),
-        ('name', '=', menu_name)
-    ], limit=1, fields=['res_id'])
-    res_id = o and o[0] or False
-    if not res_id:
+    xmlid = '%s.%s' % (module_name, menu_name)
+    menu = get_menus([xmlid], odoo_lang)[xmlid]
+    if not menu:
         return None
-    menu = _client.IrUiMenu.browse(res_id['res_id'], context={'lang': odoo_lang})
     if show_name_only:
-        text = menu.name or None
+        text = menu['name'] or None
     else:
-        text = menu.complete_name or None
+        text = menu['complete_name'] or None
     return text
 
 
@@ -99,7 +516,8 @@ class MenuDirective(Directive):
     }
 
     def run(self):
-        config = self.state.document.settings.env.config
+        env = self.state.document.settings.env
+        config = env.config
         content = self.arguments[0]
         if 'nameonly' in self.options:
             show_name_only = True
@@ -112,12 +530,36 @@ class MenuDirective(Directive):
 
         module_name, menu_name = content.split('/')
 
+        _profile.count('directive:menu')
         text = get_menu_data(module_name, menu_name, show_name_only, config.odoo_lang)
+        note_dependency(env, ('menu', module_name, menu_name, show_name_only),
+                        text)
         if text is None:
             return [self.state_machine.reporter.warning(
                 'Menu entry "%s" not found.' % content, line=self.lineno)]
         text = text.replace('/', u' \N{TRIANGULAR BULLET} ')
-        return [nodes.inline(text=text, classes=classes)]
+        return [mark_reference(nodes.inline(text=text, classes=classes),
+                               'menu', module_name, menu_name)]
+
+
+def get_field_list(model_name, optfields, odoo_lang):
+    """Return the fields_get() description of the fields listed by the
+    ``fields`` directive, in order."""
+    res1 = get_model_fields(model_name, odoo_lang) or {}
+    if not optfields:
+        fields = sorted(res1)
+    else:
+        fields = optfields.split(' ')
+    l = [x for x in fields if
+         x not in ['create_uid', 'create_date', 'write_uid', 'write_date']]
+    res = OrderedDict()
+    for a in l:
+        res[a] = res1[a]
+    return res
+
+
+def field_list_signature(res):
+    return [(k, v.get('string'), v.get('help')) for k, v in res.items()]
 
 
 class OdooModelFieldList(Directive):
@@ -130,55 +572,52 @@ class OdooModelFieldList(Directive):
         'class': directives.class_option
     }
     default_fields = []
-    global _client
 
     def run(self):
-        config = self.state.document.settings.env.config
+        env = self.state.document.settings.env
+        config = env.config
         model_name = self.arguments[0]
-        optfields = self.options.get('fields')
-        if not optfields:
-            fields = _client.model(model_name).keys()
-        else:
-            fields = optfields.split(' ')
-        l = [x for x in fields if
-             x not in ['create_uid', 'create_date', 'write_uid', 'write_date']]
-        res1 = _client.execute(model_name, 'fields_get', l,
-                               context={'lang': config.odoo_lang})
-        res = OrderedDict()
-        print('**************************', model_name)
-        for a in l:
-            res[a] = res1[a]
+        optfields = self.options.get('fields') or ''
+        _profile.count('directive:fields')
+        res = get_field_list(model_name, optfields, config.odoo_lang)
+        note_dependency(env, ('fields', model_name, optfields),
+                        field_list_signature(res))
         classes = [config.odoodoc_fieldlistclass]
         if 'class' in self.options:
             classes.extend(self.options['class'])
-        return [nodes.field_list('', *(
-            nodes.field('',
-                        nodes.field_name(text=v['string'] or k),
-                        nodes.field_body(
-                            '',
-                            # keep help formatting around (e.g. newlines for lists)
-                            nodes.line_block('', *(
-                                nodes.line(text=line)
-                                for line in v['help'].split('\n')
-                            ))
-                        )
-                        )
+        fields = [
+            mark_reference(nodes.field(
+                '',
+                nodes.field_name(text=v['string'] or k),
+                nodes.field_body(
+                    '',
+                    # keep help formatting around (e.g. newlines for lists)
+                    nodes.line_block('', *(
+                        nodes.line(text=line)
+                        for line in v['help'].split('\n')
+                    ))
+                )
+            ), 'field', model_name, k)
             for k, v in res.iteritems()
             # only display if there's a help text
             if v.get('help')
-        ), classes=classes, format='html')]
+        ]
+        return [mark_reference(
+            nodes.field_list('', *fields, classes=classes, format='html'),
+            'model', model_name)]
 
 
+@profiled(get_profile)
 def get_model_data(model_name, odoo_lang):
-    global _client
-    ctx = {'lang': odoo_lang}
-    try:
-        xname = _client.IrModel.get([
-            ('model', '=', model_name)
-        ], context=ctx)
-    except:
-        xname = None
-    return xname
+    key = (odoo_lang, model_name)
+    if key not in _model_names:
+        try:
+            _model_names[key] = cached(
+                'model', model_name, odoo_lang,
+                lambda: get_backend().model_name(model_name, odoo_lang))
+        except:
+            _model_names[key] = None
+    return _model_names[key]
 
 
 class ModelDirective(Directive):
@@ -192,7 +631,8 @@ class ModelDirective(Directive):
     }
 
     def run(self):
-        config = self.state.document.settings.env.config
+        env = self.state.document.settings.env
+        config = env.config
         model_name = self.arguments[0]
         # if 'full' in self.options:
         #     show_help = True
@@ -203,88 +643,143 @@ class ModelDirective(Directive):
         if 'class' in self.options:
             classes.extend(self.options['class'])
 
+        _profile.count('directive:model')
         text = get_model_data(model_name, config.odoo_lang)
+        note_dependency(env, ('model', model_name), text)
         if text is None:
             return [self.state_machine.reporter.warning(
                 'Model "%s" not found.' % model_name, line=self.lineno)]
-        return [nodes.literal(text=text, classes=classes)]
+        return [mark_reference(nodes.literal(text=text, classes=classes),
+                               'model', model_name)]
 
 
 class References(Transform):
     """
     Parse and transform menu and field references in a document.
+
+    Every reference of the document is collected first, the metadata they
+    use is fetched in one batch and each text node is then rebuilt in a
+    single pass.
     """
 
     default_priority = 999
 
     def apply(self):
-        config = self.document.settings.env.config
+        env = self.document.settings.env
+        config = env.config
         pattern = config.odoodoc_pattern
         if isinstance(pattern, basestring):
             pattern = re.compile(pattern)
+        found = []
+        models = set()
+        menus = set()
         for node in self.document.traverse(nodes.Text):
             parent = node.parent
             if isinstance(parent, (nodes.literal, nodes.FixedTextElement)):
                 # ignore inline and block literal text
                 continue
             text = unicode(node)
-            modified = False
-
-            match = pattern.search(text)
-            while match:
-                if len(match.groups()) != 1:
-                    raise ValueError(
-                        'odoodoc_issue_pattern must have '
-                        'exactly one group: {0!r}'.format(match.groups()))
-                # extract the reference data (excluding the leading dash)
-                refdata = match.group(1)
-                start = match.start(0)
-                end = match.end(0)
-
-                data = refdata.split(':')
-                kind = data[0]
-                content = data[1]
-                if len(data) > 2:
-                    options = data[2]
-                else:
-                    options = None
-
+            matches = list(pattern.finditer(text))
+            if not matches:
+                continue
+            if pattern.groups != 1:
+                raise ValueError(
+                    'odoodoc_issue_pattern must have '
+                    'exactly one group: {0!r}'.format(matches[0].groups()))
+            for match in matches:
+                kind, content, options = self.parse(match.group(1))
                 if kind == 'field':
-                    model_name, field_name = content.split('/')
-                    if options == 'help':
-                        show_help = True
-                    else:
-                        show_help = False
-                    replacement = get_field_data(model_name, field_name, show_help,
-                                                 config.odoo_lang)
+                    models.add(content.split('/')[0])
                 elif kind == 'menu':
-                    module_name, menu_name = content.split('/')
-                    if options == 'nameonly':
-                        show_name_only = True
-                    else:
-                        show_name_only = False
-                    replacement = get_menu_data(module_name, menu_name, show_name_only,
-                                                config.odoo_lang)
-                else:
-                    replacement = refdata
+                    menus.add(content.replace('/', '.', 1))
+            found.append((node, text, matches))
 
-                text = text[:start] + (replacement or u'') + text[end:]
-                modified = True
+        prefetch_metadata(models, menus, (), config.odoo_lang)
+
+        for node, text, matches in found:
+            parent = node.parent
+            parts = []
+            end = 0
+            for match in matches:
+                parts.append(text[end:match.start(0)])
+                parts.append(self.resolve(parent, match.group(1)) or u'')
+                end = match.end(0)
+            parts.append(text[end:])
+            parent.replace(node, [nodes.Text(u''.join(parts))])
+
+    @staticmethod
+    def parse(refdata):
+        """Split the data of a reference into its kind, content and
+        options."""
+        data = refdata.split(':')
+        if len(data) < 2:
+            return None, None, None
+        return data[0], data[1], len(data) > 2 and data[2] or None
+
+    def resolve(self, parent, refdata):
+        """Return the text replacing a reference found in ``parent``."""
+        env = self.document.settings.env
+        config = env.config
+        kind, content, options = self.parse(refdata)
+        _profile.count('reference:%s' % kind)
+        if kind == 'field':
+            model_name, field_name = content.split('/')
+            show_help = options == 'help'
+            replacement = get_field_data(model_name, field_name, show_help,
+                                         config.odoo_lang)
+            note_dependency(env, ('field', model_name, field_name,
+                                  show_help), replacement)
+            mark_reference(parent, 'field', model_name, field_name)
+        elif kind == 'menu':
+            module_name, menu_name = content.split('/')
+            show_name_only = options == 'nameonly'
+            replacement = get_menu_data(module_name, menu_name,
+                                        show_name_only, config.odoo_lang)
+            note_dependency(env, ('menu', module_name, menu_name,
+                                  show_name_only), replacement)
+            mark_reference(parent, 'menu', module_name, menu_name)
+        else:
+            replacement = refdata
+        return replacement
 
-                match = pattern.search(text)
 
-            if modified:
-                parent.replace(node, [nodes.Text(text)])
+def activate(app):
+    """Make the module level state refer to ``app`` and its cache."""
+    global _app, _cache, _profile
+    _app = app
+    _cache = None
+    _profile = BuildProfile()
+    path = app.config.odoodoc_cache_path
+    if path:
+        # opened by every build, as the builds of an application may run
+        # in different threads
+        _cache = MetadataCache(path, ttl=app.config.odoodoc_cache_ttl,
+                               max_entries=app.config.odoodoc_cache_size)
 
 
 def init_transformer(app):
-    global _client
     if app.config.odoodoc_plaintext:
         app.add_transform(References)
-    _client = erppeek.Client(app.config.odoo_server,
-                             db=app.config.odoo_db,
-                             user=app.config.odoo_user,
-                             password=app.config.odoo_pwd)
+
+
+def finish_build(app, exception):
+    global _backend, _cache
+    # the backend may hold a cursor or a connection of this build only
+    _backend = None
+    _model_fields.clear()
+    _model_names.clear()
+    _menus.clear()
+    _profile.stop('write')
+    _profile.write(os.path.join(app.doctreedir, PROFILE_FILENAME))
+    if _cache is None:
+        return
+    try:
+        _cache.flush()
+        app.info('odoodoc metadata cache: %(hits)d hits, %(misses)d misses'
+                 % _cache.stats())
+    finally:
+        _cache.close()
+        _cache = None
 
 
 def icon_role(name, rawtext, text, lineno, inliner, options={}, content=[]):
@@ -300,10 +795,16 @@ def odoomenu_role(name, rawtext, text, lineno, inliner, options={}, content=[]):
     config = app.config
 
     module_name, menu_name = text.split('/')
+    _profile.count('role:odoomenu')
     s = get_menu_data(module_name, menu_name, False, config.odoo_lang)
+    note_dependency(inliner.document.settings.env,
+                    ('menu', module_name, menu_name, False), s)
     s = s.replace('/', '  --> ')
-    return roles.menusel_role('menuselection', rawtext, s, lineno, inliner, options,
-                              content)
+    result, messages = roles.menusel_role('menuselection', rawtext, s, lineno,
+                                          inliner, options, content)
+    for node in result:
+        mark_reference(node, 'menu', module_name, menu_name)
+    return result, messages
 
 
 def odoofield_role(name, rawtext, text, lineno, inliner, options={}, content=[]):
@@ -311,25 +812,37 @@ def odoofield_role(name, rawtext, text, lineno, inliner, options={}, content=[])
     config = app.config
 
     model_name, field_name = text.split('/')
+    _profile.count('role:odoofield')
     s = get_field_data(model_name, field_name, False, config.odoo_lang)
+    note_dependency(inliner.document.settings.env,
+                    ('field', model_name, field_name, False), s)
     # node = nodes.inline(rawsource=rawtext, text=s)
-    node = nodes.literal(rawsource=rawtext, text=s)
+    node = mark_reference(nodes.literal(rawsource=rawtext, text=s),
+                          'field', model_name, field_name)
     # node['classes'].append('guilabel')
     return [node], []
 
 
 def setup(app):
-    app.add_config_value('odoo_server', None, 'env')
-    app.add_config_value('odoo_db', None, 'env')
-    app.add_config_value('odoo_user', None, 'env')
-    app.add_config_value('odoo_pwd', None, 'env')
+    app.add_config_value('odoo_server', None, '')
+    app.add_config_value('odoo_db', None, '')
+    app.add_config_value('odoo_user', None, '')
+    app.add_config_value('odoo_pwd', None, '')
     app.add_config_value('odoo_lang', 'es_ES', 'env')
     app.add_config_value('odoodoc_plaintext', True, 'env')
-    app.add_config_value('odoodoc_pattern', re.compile(r'@(.|[^@]+)@'), 'env')
+    app.add_config_value('odoodoc_pattern', DEFAULT_PATTERN, 'env')
     app.add_config_value('odoodoc_menuclass', 'odoodocmenu', 'env')
     app.add_config_value('odoodoc_fieldclass', 'odoodocfield', 'env')
     app.add_config_value('odoodoc_modelclass', 'odoodocmodel', 'env')
     app.add_config_value('odoodoc_fieldlistclass', 'odoodocfieldlist', 'env')
+    app.add_config_value('odoodoc_backend', 'erppeek', '')
+    app.add_config_value('odoodoc_cache_path', None, '')
+    app.add_config_value('odoodoc_cache_ttl', 7 * 24 * 3600, '')
+    app.add_config_value('odoodoc_cache_size', 100000, '')
+    app.add_config_value('odoodoc_cache_signature', None, '')
+    app.add_config_value('odoodoc_rpc_timeout', 60, '')
+    app.add_config_value('odoodoc_rpc_retries', 3, '')
+    app.add_config_value('odoodoc_rpc_threads', 4, '')
 
     app.add_directive('field', FieldDirective)
     app.add_directive('menu', MenuDirective)
@@ -341,3 +854,12 @@ def setup(app):
     app.add_role('odoofield', odoofield_role)
 
     app.connect('builder-inited', init_transformer)
+    app.connect('env-get-outdated', outdated_dependencies)
+    app.connect('env-purge-doc', purge_dependencies)
+    app.connect('env-before-read-docs', prefetch_references)
+    app.connect('source-read', start_document)
+    app.connect('doctree-read', stop_document)
+    app.connect('doctree-read', record_references)
+    app.connect('env-updated', start_writing)
+    app.connect('build-finished', finish_build)
+    app.connect('build-finished', write_lookup_table)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+    odoodoc.backends
+    ----------------
+
+    Sources of the Odoo metadata used by the odoodoc directives.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import hashlib
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    import httplib
+    import xmlrpclib
+except ImportError:
+    import http.client as httplib
+    import xmlrpc.client as xmlrpclib
+
+import erppeek
+
+
+def modules_signature(modules):
+    """Return a digest of a list of ``{'name', 'latest_version'}``."""
+    digest = hashlib.sha1()
+    for module in sorted(modules, key=lambda m: m['name']):
+        digest.update(('%s=%s;' % (module['name'], module['latest_version'])
+                       ).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class KeepAliveTransport(xmlrpclib.Transport):
+    """XML-RPC transport keeping its connection open between calls.
+
+    Every exchange times out after ``timeout`` seconds and is retried up to
+    ``retries`` times, waiting longer each time, when the connection fails
+    or the server answers with a 5xx status.  Faults raised by Odoo itself
+    are not retried.
+    """
+
+    # seconds waited before the first retry, doubled on each one
+    backoff = 0.5
+
+    def __init__(self, timeout=60, retries=3, use_https=False):
+        xmlrpclib.Transport.__init__(self)
+        self.timeout = timeout
+        self.retries = retries
+        self.use_https = use_https
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        if self.use_https:
+            connection = httplib.HTTPSConnection(chost, timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(chost, timeout=self.timeout)
+        self._connection = host, connection
+        return connection
+
+    def request(self, host, handler, request_body, verbose=False):
+        for attempt in range(self.retries + 1):
+            try:
+                return xmlrpclib.Transport.request(
+                    self, host, handler, request_body, verbose)
+            except (socket.error, httplib.HTTPException,
+                    xmlrpclib.ProtocolError) as e:
+                self.close()
+                if attempt == self.retries or (
+                        isinstance(e, xmlrpclib.ProtocolError) and
+                        e.errcode < 500):
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+
+class Backend(object):
+    """Interface of a metadata backend.
+
+    Menus are identified by their ``module.name`` xmlid.
+    """
+
+    def registry_signature(self):
+        """Return a digest of the installed modules and their versions."""
+        raise NotImplementedError
+
+    def fields_get(self, model_name, lang):
+        """Return the fields_get() description of all fields of a model."""
+        raise NotImplementedError
+
+    def fields_get_many(self, model_names, lang):
+        """Return the fields_get() description of several models by name,
+        leaving out the models that could not be read."""
+        res = {}
+        for model_name in model_names:
+            try:
+                res[model_name] = self.fields_get(model_name, lang)
+            except Exception:
+                continue
+        return res
+
+    def read_menus(self, xmlids, lang):
+        """Return the name and complete name of each menu by xmlid, or
+        None for the xmlids that do not exist."""
+        raise NotImplementedError
+
+    def model_name(self, model_name, lang):
+        """Return the description of a model, or None."""
+        raise NotImplementedError
+
+    def model_names(self, model_names, lang):
+        """Return the description of several models by name."""
+        return dict((model_name, self.model_name(model_name, lang))
+                    for model_name in model_names)
+
+
+class ErppeekBackend(Backend):
+    """Reads the metadata from a remote server over XML-RPC.
+
+    Calls go over keep-alive connections, see :class:`KeepAliveTransport`.
+    Several models are read at once by a bounded pool of ``threads``
+    threads, each one with a connection of its own.
+    """
+
+    def __init__(self, server, db, user, password, timeout=60, retries=3,
+                 threads=4):
+        self.server = server.rstrip('/')
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.retries = retries
+        self.threads = threads
+        self.client = erppeek.Client(self.server,
+                                     transport=self._transport())
+        self.uid = self.client.login(user, password=password, database=db)
+        self._local = threading.local()
+
+    def _transport(self):
+        return KeepAliveTransport(self.timeout, self.retries,
+                                  use_https=self.server.startswith('https'))
+
+    def _execute_kw(self, model_name, method, args, kwargs):
+        """Call a model method over the connection of the calling
+        thread."""
+        proxy = getattr(self._local, 'object', None)
+        if proxy is None:
+            proxy = self._local.object = xmlrpclib.ServerProxy(
+                self.server + '/xmlrpc/object', transport=self._transport(),
+                allow_none=True)
+        return proxy.execute_kw(self.db, self.uid, self.password,
+                                model_name, method, args, kwargs)
+
+    def registry_signature(self):
+        return modules_signature(self.client.execute(
+            'ir.module.module', 'search_read',
+            [('state', '=', 'installed')], ['name', 'latest_version']))
+
+    def fields_get(self, model_name, lang):
+        return self.client.execute(model_name, 'fields_get',
+                                   context={'lang': lang})
+
+    def fields_get_many(self, model_names, lang):
+        def fetch(model_name):
+            try:
+                return model_name, self._execute_kw(
+                    model_name, 'fields_get', [], {'context': {'lang': lang}})
+            except Exception:
+                return model_name, None
+
+        if not model_names:
+            return {}
+        pool = ThreadPool(min(self.threads, len(model_names)))
+        try:
+            results = pool.map(fetch, model_names)
+        finally:
+            pool.terminate()
+        return dict((model_name, value) for model_name, value in results
+                    if value is not None)
+
+    def read_menus(self, xmlids, lang):
+        # one ir.model.data search_read and one ir.ui.menu read for all
+        pairs = [xmlid.split('.', 1) for xmlid in xmlids]
+        data = self.client.execute(
+            'ir.model.data', 'search_read',
+            [('model', '=', 'ir.ui.menu'),
+             ('module', 'in', list(set(p[0] for p in pairs))),
+             ('name', 'in', list(set(p[1] for p in pairs)))],
+            ['module', 'name', 'res_id'])
+        res_ids = dict(('%s.%s' % (d['module'], d['name']), d['res_id'])
+                       for d in data)
+        menus = {}
+        if res_ids:
+            for menu in self.client.execute('ir.ui.menu', 'read',
+                                            list(set(res_ids.values())),
+                                            ['name', 'complete_name'],
+                                            context={'lang': lang}):
+                menus[menu['id']] = {'name': menu['name'],
+                                     'complete_name': menu['complete_name']}
+        return dict((xmlid, menus.get(res_ids.get(xmlid)))
+                    for xmlid in xmlids)
+
+    def model_name(self, model_name, lang):
+        model = self.client.IrModel.get([
+            ('model', '=', model_name)
+        ], context={'lang': lang})
+        return model and model.name or None
+
+    def model_names(self, model_names, lang):
+        names = dict((model['model'], model['name']) for model in
+                     self.client.execute('ir.model', 'search_read',
+                                         [('model', 'in', list(model_names))],
+                                         ['model', 'name'],
+                                         context={'lang': lang}))
+        return dict((model_name, names.get(model_name) or None)
+                    for model_name in model_names)
+
+
+class CacheBackend(Backend):
+    """Serves nothing by itself, so that only the entries of the persistent
+    cache stored under ``signature`` are available."""
+
+    def __init__(self, signature):
+        self.signature = signature
+
+    def registry_signature(self):
+        return self.signature
+
+    def fields_get(self, model_name, lang):
+        raise LookupError('Model %s is not cached' % model_name)
+
+    def read_menus(self, xmlids, lang):
+        raise LookupError('Menus %s are not cached' % ', '.join(xmlids))
+
+    def model_name(self, model_name, lang):
+        raise LookupError('Model %s is not cached' % model_name)
+
+
+class EnvBackend(Backend):
+    """Reads the metadata straight from the registry of an Odoo
+    environment, for builds running inside the server itself."""
+
+    def __init__(self, env):
+        self.env = env
+
+    def registry_signature(self):
+        return modules_signature(self.env['ir.module.module'].search_read(
+            [('state', '=', 'installed')], ['name', 'latest_version']))
+
+    def fields_get(self, model_name, lang):
+        return self.env[model_name].with_context(lang=lang).fields_get()
+
+    def read_menus(self, xmlids, lang):
+        IrModelData = self.env['ir.model.data']
+        res_ids = {}
+        for xmlid in xmlids:
+            res_id = IrModelData.xmlid_to_res_id(xmlid)
+            if res_id:
+                res_ids[xmlid] = res_id
+        # browsing all menus together lets the ORM read them in one query
+        menus = {}
+        for menu in self.env['ir.ui.menu'].with_context(lang=lang).browse(
+                list(set(res_ids.values()))).exists():
+            menus[menu.id] = {'name': menu.name,
+                              'complete_name': menu.complete_name}
+        return dict((xmlid, menus.get(res_ids.get(xmlid)))
+                    for xmlid in xmlids)
+
+    def model_name(self, model_name, lang):
+        model = self.env['ir.model'].with_context(lang=lang).search(
+            [('model', '=', model_name)], limit=1)
+        return model.name or None
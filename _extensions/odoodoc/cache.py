@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+    odoodoc.cache
+    -------------
+
+    Persistent cache of the Odoo metadata used by the odoodoc directives.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+
+class MetadataCache(object):
+    """SQLite backed store of field, menu and model metadata.
+
+    Entries are keyed by kind, key, language and the signature of the
+    installed modules, so installing or upgrading any module makes every
+    previous entry unreachable.  Entries older than ``ttl`` seconds are
+    ignored and, past ``max_entries``, the least recently used ones are
+    evicted.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=100000):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._touched = set()
+        self._conn = sqlite3.connect(path, timeout=30)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                ' kind TEXT, key TEXT, lang TEXT, signature TEXT,'
+                ' value TEXT, created REAL, accessed REAL,'
+                ' PRIMARY KEY (kind, key, lang, signature))')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS metadata_accessed '
+                'ON metadata (accessed)')
+
+    def get(self, kind, key, lang, signature):
+        """Return a ``(found, value)`` tuple."""
+        ident = (kind, key, lang, signature)
+        row = self._conn.execute(
+            'SELECT value, created FROM metadata WHERE kind = ? AND key = ?'
+            ' AND lang = ? AND signature = ?', ident).fetchone()
+        if row is None or (self.ttl and row[1] + self.ttl < time.time()):
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._touched.add(ident)
+        return True, json.loads(row[0])
+
+    def set(self, kind, key, lang, signature, value):
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (kind, key, lang, signature, json.dumps(value), now, now))
+
+    def set_many(self, kind, lang, signature, values):
+        """Store every ``key: value`` item of ``values`` at once."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(kind, key, lang, signature, json.dumps(value), now, now)
+                 for key, value in values.items()])
+
+    def flush(self):
+        """Persist access times, drop expired entries and enforce the
+        size bound."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                'UPDATE metadata SET accessed = ? WHERE kind = ? AND key = ?'
+                ' AND lang = ? AND signature = ?',
+                [(now,) + ident for ident in self._touched])
+            if self.ttl:
+                self._conn.execute('DELETE FROM metadata WHERE created < ?',
+                                   (now - self.ttl,))
+            self._conn.execute(
+                'DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM '
+                'metadata ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
+        self._touched.clear()
+
+    def close(self):
+        self._conn.close()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+    odoodoc.lookup
+    --------------
+
+    Table from the models, fields and menus referenced by the documentation
+    to the section documenting them, used for context-sensitive help.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import json
+import os
+import threading
+
+LOOKUP_FILENAME = '_lookup.json'
+
+# an occurrence in a title weighs as many as this many in the body
+TITLE_WEIGHT = 5
+
+
+def lookup_key(kind, *parts):
+    """Return the key of a referenced object, e.g. ``sale.order/state``
+    for a field or ``sale.menu_sale_order`` for a menu."""
+    if kind == 'field':
+        return '%s/%s' % parts
+    if kind == 'menu':
+        return '%s.%s' % parts
+    return parts[0]
+
+
+def build_lookup(occurrences, get_uri):
+    """Return the best target of every referenced object.
+
+    :param occurrences: ``{docname: [(kind, key, anchor, in_title)]}``
+    :param get_uri: function returning the URI of a document
+    :return: ``{kind: {key: uri}}``, the URI including the anchor of the
+        section
+    """
+    scores = {}
+    for docname, refs in occurrences.items():
+        for kind, key, anchor, in_title in refs:
+            target = (docname, anchor)
+            by_target = scores.setdefault((kind, key), {})
+            by_target[target] = by_target.get(target, 0) + \
+                (TITLE_WEIGHT if in_title else 1)
+    lookup = {}
+    for (kind, key), by_target in scores.items():
+        (docname, anchor), score = min(
+            by_target.items(), key=lambda item: (-item[1], item[0]))
+        uri = get_uri(docname)
+        if anchor:
+            uri += '#' + anchor
+        lookup.setdefault(kind, {})[key] = uri
+    return lookup
+
+
+def write_lookup(lookup, dest):
+    """Atomically replace ``dest`` with ``lookup``."""
+    tmp = '%s.%d' % (dest, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(lookup, f, sort_keys=True)
+    os.rename(tmp, dest)
+
+
+def merge_lookups(dest, sources):
+    """Atomically replace ``dest`` with the lookup table of several ones.
+
+    :param sources: ``(prefix, path)`` of each table, ``prefix`` being
+        prepended to its URIs; an object documented in several tables
+        keeps the target of the first one
+    """
+    merged = {}
+    for prefix, path in sources:
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            lookup = json.load(f)
+        for kind, targets in lookup.items():
+            by_key = merged.setdefault(kind, {})
+            for key, uri in targets.items():
+                by_key.setdefault(key, prefix + uri)
+    write_lookup(merged, dest)
+
+
+class LookupTable(object):
+    """Read-only access to a written lookup table, loaded again when a
+    build replaces it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat = None
+        self._lookup = {}
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return {}
+        stat = (stat.st_ino, stat.st_mtime)
+        with self._lock:
+            if stat != self._stat:
+                with open(self.path) as f:
+                    self._lookup = json.load(f)
+                self._stat = stat
+            return self._lookup
+
+    def get(self, kind, key):
+        """Return the URI documenting an object, or None."""
+        return self._load().get(kind, {}).get(key)
+
+    def find(self, model=None, field=None, menu=None):
+        """Return the URI best documenting a field, a model or a menu,
+        falling back from a field to its model."""
+        if menu:
+            return self.get('menu', menu)
+        if model and field:
+            uri = self.get('field', lookup_key('field', model, field))
+            if uri:
+                return uri
+        if model:
+            return self.get('model', model)
+        return None
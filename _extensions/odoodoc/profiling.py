@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+    odoodoc.profiling
+    -----------------
+
+    Timings and counters of a build, written as a JSON report.
+
+    :copyright: Copyright 2016 by Minorisa, S.L.
+    :license: BSD, see LICENSE for details.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+PROFILE_FILENAME = 'odoodoc_profile.json'
+
+# documents listed in the report, the slowest to read first
+SLOWEST_DOCUMENTS = 20
+
+
+class BuildProfile(object):
+    """Collects where the time of a build goes.
+
+    * ``phases``: seconds spent in each phase of the build
+    * ``counters``: uses of each directive, role and inline reference
+    * ``calls``: count, total and maximum seconds of each timed call, e.g.
+      the metadata lookups and the backend requests
+    * ``documents``: seconds spent reading each document
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.counters = {}
+        self.calls = {}
+        self.documents = {}
+        self._started = {}
+
+    def start(self, name):
+        self._started[name] = time.time()
+
+    def stop(self, name):
+        """Record the time elapsed since ``name`` was started, if it was."""
+        started = self._started.pop(name, None)
+        if started is not None:
+            self.phases[name] = self.phases.get(name, 0) + \
+                time.time() - started
+
+    def count(self, name):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def add_call(self, name, seconds):
+        calls = self.calls.setdefault(name, {'count': 0, 'seconds': 0.0,
+                                             'max': 0.0})
+        calls['count'] += 1
+        calls['seconds'] += seconds
+        calls['max'] = max(calls['max'], seconds)
+
+    @contextmanager
+    def timed(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_call(name, time.time() - start)
+
+    def start_document(self, docname):
+        self._started[('doc', docname)] = time.time()
+
+    def stop_document(self, docname):
+        started = self._started.pop(('doc', docname), None)
+        if started is not None:
+            self.documents[docname] = time.time() - started
+
+    def as_dict(self):
+        slowest = sorted(self.documents.items(),
+                         key=lambda item: -item[1])[:SLOWEST_DOCUMENTS]
+        return {
+            'phases': OrderedDict((name, round(seconds, 3))
+                                  for name, seconds in self.phases.items()),
+            'counters': self.counters,
+            'calls': dict((name, {
+                'count': calls['count'],
+                'seconds': round(calls['seconds'], 3),
+                'average': round(calls['seconds'] / calls['count'], 4),
+                'max': round(calls['max'], 4),
+            }) for name, calls in self.calls.items()),
+            'documents_read': len(self.documents),
+            'slowest_documents': [(docname, round(seconds, 3))
+                                  for docname, seconds in slowest],
+        }
+
+    def write(self, path):
+        """Atomically replace ``path`` with the report."""
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+        os.rename(tmp, path)
+
+
+def profiled(get_profile, name=None):
+    """Decorator timing every call of a function in the profile returned
+    by ``get_profile``."""
+    def decorate(func):
+        call_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_profile().timed(call_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
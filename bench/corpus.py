@@ -0,0 +1,128 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Synthetic documentation corpus and the Odoo metadata it references.
+
+The corpus mimics the addons of an installation: ``modules`` addons, each
+one with ``pages`` pages under ``<module>/doc/<lang>`` referencing
+``refs`` fields and menus of the fake server.  The same seed always gives
+the same corpus.
+"""
+
+import os
+import random
+
+FIELDS_PER_MODEL = 40
+MENUS_PER_MODULE = 10
+
+
+def module_name(index):
+    return 'bench_mod%03d' % index
+
+
+def model_name(index):
+    return 'bench.model%03d' % index
+
+
+class Metadata(object):
+    """Models, fields and menus of the synthetic installation."""
+
+    def __init__(self, modules):
+        self.modules = [module_name(i) for i in range(modules)]
+        self.models = dict(
+            (model_name(i), dict(
+                ('field%02d' % j, {
+                    'type': 'char',
+                    'string': 'Field %d of model %d' % (j, i),
+                    'help': 'Help of field %d of model %d.\nSecond line.'
+                            % (j, i),
+                }) for j in range(FIELDS_PER_MODEL)))
+            for i in range(modules))
+        self.menus = {}
+        for i, module in enumerate(self.modules):
+            for j in range(MENUS_PER_MODULE):
+                self.menus['%s.menu%02d' % (module, j)] = {
+                    'name': 'Menu %d' % j,
+                    'complete_name': 'Module %d/Menu %d' % (i, j),
+                }
+
+
+def page(rng, metadata, module_index, page_index, refs):
+    """Return the source of a page with ``refs`` references."""
+    module = module_name(module_index)
+    lines = ['Page %d of %s' % (page_index, module),
+             '=' * 40, '']
+    models = sorted(metadata.models)
+    for ref in range(refs):
+        if ref % 8 == 0:
+            lines.extend(['Section %d' % ref, '-' * 20, ''])
+        model = rng.choice(models)
+        field = 'field%02d' % rng.randrange(FIELDS_PER_MODEL)
+        menu = '%s/menu%02d' % (module, rng.randrange(MENUS_PER_MODULE))
+        kind = ref % 4
+        if kind == 0:
+            lines.extend(['.. field:: %s/%s' % (model, field), ''])
+        elif kind == 1:
+            lines.extend(['Open @menu:%s@ and fill @field:%s/%s@ in.'
+                          % (menu, model, field), ''])
+        elif kind == 2:
+            lines.extend([':odoofield:`%s/%s` of the :odoomenu:`%s` menu.'
+                          % (model, field, menu), ''])
+        else:
+            lines.extend(['.. model:: %s' % model, ''])
+        lines.extend([' '.join(rng.choice(WORDS) for i in range(40)), ''])
+    return '\n'.join(lines) + '\n'
+
+
+def generate(root, modules, pages, refs, lang='es', seed=0):
+    """Write the addons of the corpus in ``root`` and return their
+    :class:`Metadata`."""
+    rng = random.Random(seed)
+    metadata = Metadata(modules)
+    for i, module in enumerate(metadata.modules):
+        doc_dir = os.path.join(root, module, 'doc', lang)
+        if not os.path.isdir(doc_dir):
+            os.makedirs(doc_dir)
+        names = ['page%03d' % j for j in range(pages)]
+        write(os.path.join(doc_dir, 'index.rst'), '\n'.join(
+            [module, '=' * 40, '', '.. toctree::', ''] +
+            ['   %s' % name for name in names]) + '\n')
+        for j, name in enumerate(names):
+            write(os.path.join(doc_dir, name + '.rst'),
+                  page(rng, metadata, i, j, refs))
+    return metadata
+
+
+def write(filename, content):
+    """Write ``content`` unless the file already has it, so that a corpus
+    generated again does not look modified to Sphinx."""
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            if f.read() == content:
+                return
+    with open(filename, 'w') as f:
+        f.write(content)
+
+
+WORDS = ('venta cliente factura pedido albarán producto almacén compra '
+         'proveedor pago cobro contabilidad asiento diario impuesto tarifa '
+         'precio descuento cantidad unidad fecha estado confirmar validar '
+         'cancelar imprimir enviar correo informe análisis').split()
@@ -0,0 +1,217 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Local stand-in of the XML-RPC API of an Odoo server.
+
+It serves the ``db``, ``common`` and ``object`` services used by erppeek,
+with just enough of ``search``, ``read``, ``search_read`` and
+``fields_get`` for the models read by the odoodoc extension, and waits
+``latency`` seconds on every call to simulate the network.  Calls are
+counted by model and method.
+"""
+
+import threading
+import time
+
+try:
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, \
+        SimpleXMLRPCRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+SERVER_VERSION = '8.0'
+
+CORE_MODELS = ['ir.model', 'ir.model.data', 'ir.module.module', 'ir.ui.menu']
+
+
+def match(record, domain):
+    """Whether ``record`` satisfies a domain made of plain leaves."""
+    for leaf in domain:
+        if not isinstance(leaf, (list, tuple)):
+            continue
+        field, operator, value = leaf
+        current = record.get(field)
+        if operator == '=' and current != value:
+            return False
+        if operator == '!=' and current == value:
+            return False
+        if operator == 'in' and current not in value:
+            return False
+        if operator == 'not in' and current in value:
+            return False
+        if operator in ('like', 'ilike') and \
+                value.lower() not in (current or '').lower():
+            return False
+    return True
+
+
+class FakeOdoo(object):
+    """In-memory Odoo database built from a :class:`corpus.Metadata`."""
+
+    def __init__(self, metadata, db='bench', latency=0.0):
+        self.metadata = metadata
+        self.db = db
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.tables = {
+            'ir.module.module': [
+                {'id': i + 1, 'name': name, 'state': 'installed',
+                 'latest_version': '8.0.1.0'}
+                for i, name in enumerate(metadata.modules)],
+            'ir.model': [
+                {'id': i + 1, 'model': name, 'name': 'Model %s' % name}
+                for i, name in enumerate(sorted(metadata.models) +
+                                         CORE_MODELS)],
+            'ir.ui.menu': [],
+            'ir.model.data': [],
+        }
+        for i, xmlid in enumerate(sorted(metadata.menus)):
+            module, name = xmlid.split('.', 1)
+            self.tables['ir.ui.menu'].append(
+                dict(metadata.menus[xmlid], id=i + 1))
+            self.tables['ir.model.data'].append(
+                {'id': i + 1, 'module': module, 'name': name,
+                 'model': 'ir.ui.menu', 'res_id': i + 1})
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            calls, self.calls = self.calls, {}
+        return calls
+
+    def _dispatch(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'execute':
+            model, name = params[3:5]
+            args, kwargs = list(params[5:]), {}
+        elif method == 'execute_kw':
+            model, name, args = params[3:6]
+            kwargs = len(params) > 6 and params[6] or {}
+        else:
+            self.count(method)
+            return self.service(method, params)
+        self.count('%s.%s' % (model, name))
+        return self.execute(model, name, args, kwargs)
+
+    def service(self, method, params):
+        if method in ('server_version', 'version'):
+            if method == 'version':
+                return {'server_version': SERVER_VERSION,
+                        'server_version_info': [8, 0, 0, 'final', 0]}
+            return SERVER_VERSION
+        if method == 'list':
+            return [self.db]
+        if method in ('login', 'authenticate'):
+            return 1
+        raise ValueError('Unsupported method %s' % method)
+
+    def execute(self, model, name, args, kwargs):
+        # the context is the only dictionary argument
+        args = [arg for arg in args if not isinstance(arg, dict)]
+        fields = kwargs.get('fields')
+        if name == 'context_get':
+            return {'lang': 'en_US'}
+        if name in ('fields_get', 'fields_get_keys'):
+            if model in self.metadata.models:
+                res = self.metadata.models[model]
+            else:
+                res = dict((key, {'type': 'char', 'string': key})
+                           for key in self.table(model)[0])
+            return sorted(res) if name == 'fields_get_keys' else res
+        records = self.table(model)
+        if name in ('search', 'search_count', 'search_read'):
+            found = [r for r in records if match(r, args and args[0] or [])]
+            if name == 'search':
+                return [r['id'] for r in found]
+            if name == 'search_count':
+                return len(found)
+            return self.read(found, fields or (len(args) > 1 and args[1]))
+        if name == 'read':
+            ids = args[0]
+            if not isinstance(ids, list):
+                ids = [ids]
+            found = [r for r in records if r['id'] in ids]
+            res = self.read(found, fields or (len(args) > 1 and args[1]))
+            return res if isinstance(args[0], list) else res[0]
+        raise ValueError('Unsupported method %s.%s' % (model, name))
+
+    def table(self, model):
+        if model not in self.tables:
+            raise ValueError('Unknown model %s' % model)
+        return self.tables[model]
+
+    @staticmethod
+    def read(records, fields):
+        if not fields:
+            return [dict(r) for r in records]
+        return [dict((key, r.get(key)) for key in list(fields) + ['id'])
+                for r in records]
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/xmlrpc/db', '/xmlrpc/common', '/xmlrpc/object',
+                 '/xmlrpc/2/db', '/xmlrpc/2/common', '/xmlrpc/2/object')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def serve(fake, host='127.0.0.1', port=0):
+    """Start serving ``fake`` in a thread and return the server, whose
+    URL is ``http://host:server.server_address[1]``."""
+    server = Server((host, port), requestHandler=RequestHandler,
+                    logRequests=False, allow_none=True)
+    server.register_instance(fake)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from corpus import Metadata
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modules', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--port', type=int, default=8069)
+    options = parser.parse_args()
+    server = serve(FakeOdoo(Metadata(options.modules),
+                            latency=options.latency), port=options.port)
+    print('Fake Odoo serving on http://127.0.0.1:%d' % options.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,186 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Benchmark of the documentation build and serving.
+
+Generates a synthetic corpus, serves its metadata from a fake Odoo server
+and measures the wall time, the metadata requests and the peak memory of
+a cold build, a warm build and a build after changing one file, then
+load-tests the serving of the result with and without the page cache.
+
+Run with the interpreter and packages of the Odoo server::
+
+    python bench/run.py --modules 20 --pages 10 --refs 20 --latency 0.005
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, BENCH_DIR)
+
+import corpus  # noqa
+import fake_odoo  # noqa
+
+CONF_TEMPLATE = """
+import sys
+sys.path.insert(0, %(extensions)r)
+
+extensions = ['odoodoc', 'dochelp_search']
+master_doc = 'index'
+project = 'bench'
+language = %(lang)r
+html_theme = 'default'
+
+odoo_server = %(server)r
+odoo_db = 'bench'
+odoo_user = 'admin'
+odoo_pwd = 'admin'
+odoo_lang = %(odoo_lang)r
+odoodoc_cache_path = %(cache_path)r
+"""
+
+
+def prepare_sources(workdir, addons, modules, lang, server):
+    """Lay the corpus out like the wizard does and return the folder of
+    the sources."""
+    srcdir = os.path.join(workdir, 'src')
+    if not os.path.isdir(srcdir):
+        os.makedirs(srcdir)
+    for module in modules:
+        link = os.path.join(srcdir, module)
+        if not os.path.exists(link):
+            os.symlink(os.path.join(addons, module, 'doc', lang), link)
+    corpus.write(os.path.join(srcdir, 'index.rst'), '\n'.join(
+        ['Benchmark', '=' * 40, '', '.. toctree::', '   :maxdepth: 1', ''] +
+        ['   %s/index' % module for module in modules]) + '\n')
+    corpus.write(os.path.join(srcdir, 'conf.py'), CONF_TEMPLATE % {
+        'extensions': os.path.join(ADDON_DIR, '_extensions'),
+        'lang': lang,
+        'odoo_lang': '%s_%s' % (lang, lang.upper()),
+        'server': server,
+        'cache_path': os.path.join(workdir, 'metadata.sqlite'),
+    })
+    return srcdir
+
+
+def build(workdir, srcdir, lang, fake):
+    """Run a build in a process of its own and return its measures."""
+    fake.reset()
+    output = subprocess.check_output([
+        sys.executable, os.path.join(BENCH_DIR, 'sphinx_build.py'), srcdir,
+        os.path.join(workdir, 'build', lang, 'html'),
+        os.path.join(workdir, 'doctrees'), 'html',
+        os.path.join(workdir, 'build.log')])
+    res = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    calls = fake.reset()
+    res['rpc'] = sum(count for name, count in calls.items()
+                     if '.' in name)
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modules', type=int, default=10)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--refs', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help="seconds waited by every metadata request")
+    parser.add_argument('--lang', default='es')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workdir',
+                        help="kept between runs when given, temporary "
+                             "otherwise")
+    parser.add_argument('--json', action='store_true',
+                        help="print the results as JSON")
+    options = parser.parse_args()
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='dochelp-bench-')
+    addons = os.path.join(workdir, 'addons')
+    metadata = corpus.generate(addons, options.modules, options.pages,
+                               options.refs, options.lang)
+    fake = fake_odoo.FakeOdoo(metadata, latency=options.latency)
+    server = fake_odoo.serve(fake)
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+    srcdir = prepare_sources(workdir, addons, metadata.modules,
+                             options.lang, url)
+
+    results = {}
+    try:
+        # cold: no output, no doctrees and no metadata cache
+        for name in ('build', 'doctrees', 'metadata.sqlite'):
+            path = os.path.join(workdir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        results['cold'] = build(workdir, srcdir, options.lang, fake)
+        results['warm'] = build(workdir, srcdir, options.lang, fake)
+        page = os.path.join(addons, metadata.modules[0], 'doc',
+                            options.lang, 'page000.rst')
+        with open(page, 'a') as f:
+            f.write('\nChanged paragraph.\n')
+        results['one_changed'] = build(workdir, srcdir, options.lang, fake)
+
+        import serving
+        build_root = os.path.join(workdir, 'build')
+        results['serve_nocache'] = serving.load_test(
+            build_root, options.lang, options.requests, options.concurrency,
+            cache=False)
+        results['serve_cache'] = serving.load_test(
+            build_root, options.lang, options.requests, options.concurrency,
+            cache=True)
+    finally:
+        server.shutdown()
+        if not options.workdir:
+            shutil.rmtree(workdir)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('%-14s %10s %8s %12s' % ('build', 'seconds', 'rpc', 'peak MB'))
+    for name in ('cold', 'warm', 'one_changed'):
+        res = results[name]
+        print('%-14s %10.2f %8d %12.1f' % (name, res['seconds'], res['rpc'],
+                                          res['maxrss_kb'] / 1024.0))
+    print('')
+    print('%-14s %10s %8s %8s %8s' % ('serving', 'req/s', 'p50 ms',
+                                      'p99 ms', 'errors'))
+    for name in ('serve_nocache', 'serve_cache'):
+        res = results[name]
+        print('%-14s %10.0f %8.2f %8.2f %8d' % (
+            name, res['requests_per_second'], res['p50_ms'], res['p99_ms'],
+            res['errors']))
+    cache = results['serve_cache']['cache']
+    print('page cache: %(hits)d hits, %(misses)d misses, %(entries)d '
+          'entries, %(bytes)d bytes' % cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Load test of the serving of a built documentation.
+
+The files are served by a Werkzeug application doing what the DocHelp
+controller does, language prefix included, through the same
+``file_serving`` module, so the serving path is measured without Odoo.
+"""
+
+import importlib
+import os
+import random
+import sys
+import threading
+import time
+
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.wrappers import Request, Response
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_file_serving():
+    """Import ``file_serving`` without importing the addon, which needs
+    Odoo."""
+    package = type(sys)('dochelp_serving')
+    package.__path__ = [ADDON_DIR]
+    sys.modules.setdefault('dochelp_serving', package)
+    return importlib.import_module('dochelp_serving.file_serving')
+
+
+file_serving = import_file_serving()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Application(object):
+    """WSGI application serving ``build_root``/<lang>/html like the
+    controller."""
+
+    def __init__(self, build_root, langs, cache=True):
+        self.build_root = build_root
+        self.langs = langs
+        self.cache = cache and file_serving.PageCache(build_root) or None
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        response = self.dispatch(request)
+        return response(environ, start_response)
+
+    def dispatch(self, request):
+        xpath = request.path[len('/dochelp/'):]
+        lang = self.langs[0]
+        parts = xpath.split('/', 1)
+        if parts[0] in self.langs:
+            lang = parts[0]
+            xpath = len(parts) > 1 and parts[1] or ''
+        filename = file_serving.resolve_path(
+            os.path.join(self.build_root, lang, 'html'),
+            xpath or 'index.html')
+        if filename is None:
+            return Response(status=404)
+        try:
+            return file_serving.serve_file(request, filename,
+                                           xpath or 'index.html',
+                                           cache=self.cache)
+        except (IOError, OSError):
+            return Response(status=404)
+
+
+def hot_paths(html_dir, lang, count=50, seed=0):
+    """Return the URL paths of a few pages and their assets."""
+    pages = []
+    assets = []
+    for dirpath, dirnames, filenames in os.walk(html_dir):
+        for name in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, name), html_dir)
+            if name.endswith('.html'):
+                pages.append(rel)
+            elif name.endswith(('.css', '.js')):
+                assets.append(rel)
+    rng = random.Random(seed)
+    pages.sort()
+    assets.sort()
+    chosen = ['index.html'] + rng.sample(pages, min(count, len(pages)))
+    return ['/dochelp/%s/%s' % (lang, rel) for rel in chosen + assets]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def load_test(build_root, lang, requests=2000, concurrency=8, cache=True,
+              gzip=True):
+    """Request hot pages from ``concurrency`` clients and return the
+    throughput, the latencies and the statistics of the page cache."""
+    app = Application(build_root, [lang], cache=cache)
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    port = server.server_address[1]
+    paths = hot_paths(os.path.join(build_root, lang, 'html'), lang)
+    headers = gzip and {'Accept-Encoding': 'gzip'} or {}
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(index):
+        rng = random.Random(index)
+        mine = []
+        for i in range(requests // concurrency):
+            # a few pages get most of the hits
+            path = paths[min(int(rng.expovariate(0.3)), len(paths) - 1)]
+            start = time.time()
+            conn = HTTPConnection('127.0.0.1', port)
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            mine.append(time.time() - start)
+            if response.status != 200:
+                with lock:
+                    errors.append((path, response.status))
+        with lock:
+            latencies.extend(mine)
+
+    start = time.time()
+    clients = [threading.Thread(target=client, args=(i,))
+               for i in range(concurrency)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.time() - start
+    server.shutdown()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'cache': app.cache and app.cache.stats() or None,
+    }
@@ -0,0 +1,50 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Build of a Sphinx project run by the benchmark in a process of its own.
+
+Usage: ``sphinx_build.py srcdir outdir doctreedir builder logfile``.
+Prints the wall time and the peak memory of the build as JSON.
+"""
+
+import json
+import resource
+import sys
+import time
+
+from sphinx.application import Sphinx
+
+
+def main(srcdir, outdir, doctreedir, builder, logfile):
+    start = time.time()
+    with open(logfile, 'a') as log:
+        app = Sphinx(srcdir, srcdir, outdir, doctreedir, builder,
+                     status=log, warning=log)
+        app.build()
+    print(json.dumps({
+        'seconds': time.time() - start,
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'status': app.statuscode,
+    }))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:6])
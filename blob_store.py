@@ -0,0 +1,311 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Content-addressed store of the published builds, shared by every node.
+
+The building node stores every file of a new generation under the digest
+of its content, along with a manifest of the generation, and marks it as
+the current one.  Other nodes publish the generation locally without
+copying anything, and fetch each file from the store the first time it
+is requested, through a node-local cache of the blobs, so files shared by
+several generations are only fetched once.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .compress import SUFFIXES
+from .file_serving import GENERATION_CHECK_INTERVAL, MANIFEST_FILE, publish
+from .publishing import (KEEP_GENERATIONS, collect_generations,
+                         current_generation, generations_folder, switch)
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Seconds a fetched blob is kept before being collected when unused, so
+# that it is not removed before being linked
+BLOB_GRACE = 60
+# Seconds a stored blob is kept before being collected when no manifest
+# refers to it, so that the blobs of a generation another node is still
+# pushing are not removed before its manifest is written
+STORE_GRACE = 60 * 60
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_copy(filename, dest):
+    """Copy ``filename`` to ``dest`` so that readers never see a partial
+    file."""
+    directory = os.path.dirname(dest)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created meanwhile by another process
+            pass
+    tmp = '%s.%d.%d' % (dest, os.getpid(), threading.current_thread().ident)
+    shutil.copyfile(filename, tmp)
+    os.rename(tmp, dest)
+
+
+class BlobStore(object):
+    """Files stored under the digest of their content in ``root``, with the
+    manifests of the generations of every target.
+
+    A target is a ``<lang>/<fmt>`` build, and the manifest of each of its
+    generations maps the path of every file to its digest and to the
+    generation its content was first published in.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def put(self, filename):
+        """Store the content of ``filename`` unless it already is and
+        return its digest."""
+        digest = file_digest(filename)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            # protects it from a concurrent collect until the manifest
+            # referring to it is written
+            os.utime(blob, None)
+        else:
+            atomic_copy(filename, blob)
+        return digest
+
+    def _target_folder(self, target):
+        return os.path.join(self.root, 'generations', target)
+
+    def read_manifest(self, target, generation):
+        try:
+            with open(os.path.join(self._target_folder(target),
+                                   '%d.json' % generation)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write_manifest(self, target, generation, files):
+        folder = self._target_folder(target)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        tmp = os.path.join(folder, '%d.json.%d' % (generation, os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(files, f)
+        os.rename(tmp, os.path.join(folder, '%d.json' % generation))
+
+    def current(self, target):
+        """Return the current generation of ``target``, or None."""
+        try:
+            with open(os.path.join(self._target_folder(target),
+                                   'current')) as f:
+                return int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set_current(self, target, generation):
+        folder = self._target_folder(target)
+        tmp = os.path.join(folder, 'current.%d' % os.getpid())
+        with open(tmp, 'w') as f:
+            f.write('%d\n' % generation)
+        os.rename(tmp, os.path.join(folder, 'current'))
+
+    def collect(self, keep=KEEP_GENERATIONS, grace=STORE_GRACE):
+        """Remove the manifests of the generations older than the last
+        ``keep`` ones besides the current one, then the blobs no manifest
+        refers to that were not stored in the last ``grace`` seconds."""
+        generations = os.path.join(self.root, 'generations')
+        used = set()
+        for dirpath, dirnames, filenames in os.walk(generations):
+            numbers = sorted(int(name[:-len('.json')]) for name in filenames
+                             if name.endswith('.json') and
+                             name[:-len('.json')].isdigit())
+            if not numbers:
+                continue
+            target = os.path.relpath(dirpath, generations)
+            current = self.current(target)
+            others = [number for number in numbers if number != current]
+            for number in others[:-keep] if keep else others:
+                os.remove(os.path.join(dirpath, '%d.json' % number))
+                numbers.remove(number)
+            for number in numbers:
+                used.update(digest for digest, origin in
+                            self.read_manifest(target, number).values())
+        removed = 0
+        limit = time.time() - grace
+        for dirpath, dirnames, filenames in os.walk(
+                os.path.join(self.root, 'blobs')):
+            for name in filenames:
+                blob = os.path.join(dirpath, name)
+                if name not in used and os.path.getmtime(blob) < limit:
+                    os.remove(blob)
+                    removed += 1
+        return removed
+
+
+def push_generation(store, target, folder, generation):
+    """Store the files of the published generation ``folder`` of ``target``
+    and make it the current one.
+
+    Files published in an earlier generation are neither hashed nor stored
+    again.
+    """
+    try:
+        with open(os.path.join(folder, MANIFEST_FILE)) as f:
+            origins = json.load(f)
+    except (IOError, OSError, ValueError):
+        origins = {}
+    previous = store.current(target)
+    previous_files = previous and store.read_manifest(target, previous) or {}
+    files = {}
+    stored = 0
+    for rel, origin in origins.items():
+        entry = previous_files.get(rel)
+        if entry and entry[1] == origin:
+            files[rel] = entry
+        else:
+            files[rel] = [store.put(os.path.join(folder, rel)), origin]
+            stored += 1
+    store.write_manifest(target, generation, files)
+    store.set_current(target, generation)
+    _logger.info('Generation %d of %s stored, %d of %d files new',
+                 generation, target, stored, len(files))
+
+
+class NodeCache(object):
+    """Node-local read-through cache of the builds of a store.
+
+    The current generation of a target built on another node is published
+    in ``build_root`` as an empty folder, whose files are fetched from the
+    store when first requested.  Fetched blobs are kept in ``build_root``
+    and hard linked into every generation using them.
+    """
+
+    def __init__(self, store, build_root,
+                 check_interval=GENERATION_CHECK_INTERVAL):
+        self.store = store
+        self.build_root = build_root
+        self.check_interval = check_interval
+        self._checked = {}
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def _blob(self, digest):
+        """Return the local copy of a blob, fetched once."""
+        blob = os.path.join(self.build_root, '.blobs', digest[:2], digest)
+        if not os.path.exists(blob):
+            atomic_copy(self.store.blob_path(digest), blob)
+        return blob
+
+    def _files(self, target, generation):
+        key = (target, generation)
+        files = self._manifests.get(key)
+        if files is None:
+            files = self.store.read_manifest(target, generation)
+            if len(self._manifests) >= 16:
+                self._manifests.clear()
+            self._manifests[key] = files
+        return files
+
+    def sync(self, target):
+        """Publish locally the current generation of ``target`` in the
+        store, checked at most once per ``check_interval``."""
+        now = time.time()
+        with self._lock:
+            if now - self._checked.get(target, 0) < self.check_interval:
+                return
+            self._checked[target] = now
+        root = os.path.join(self.build_root, target)
+        generation = self.store.current(target)
+        if generation is None or generation == current_generation(root):
+            return
+        folder = os.path.join(generations_folder(root), str(generation))
+        if not os.path.isdir(folder):
+            files = self._files(target, generation)
+            tmp = '%s.%d.tmp' % (folder, os.getpid())
+            os.makedirs(tmp)
+            with open(os.path.join(tmp, MANIFEST_FILE), 'w') as f:
+                json.dump(dict((rel, origin) for rel, (digest, origin)
+                               in files.items()), f)
+            try:
+                os.rename(tmp, folder)
+            except OSError:
+                # published meanwhile by another process of the node
+                shutil.rmtree(tmp)
+        switch(root, generation)
+        publish(self.build_root)
+        _logger.info('Generation %d of %s published from the store',
+                     generation, target)
+        collect_generations(root)
+        self.collect_blobs()
+
+    def fetch(self, target, rel):
+        """Make sure the file ``rel`` of the current generation of
+        ``target`` and its precompressed variants are on this node."""
+        self.sync(target)
+        root = os.path.join(self.build_root, target)
+        if os.path.exists(os.path.join(root, rel)):
+            return
+        generation = current_generation(root)
+        if generation is None:
+            return
+        files = self._files(target, generation)
+        folder = os.path.join(generations_folder(root), str(generation))
+        for name in [rel] + [rel + suffix for suffix in SUFFIXES.values()]:
+            entry = files.get(name.replace(os.sep, '/'))
+            dest = os.path.join(folder, name)
+            if entry is None or os.path.exists(dest):
+                continue
+            blob = self._blob(entry[0])
+            directory = os.path.dirname(dest)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    pass
+            tmp = '%s.%d.%d' % (dest, os.getpid(),
+                                threading.current_thread().ident)
+            os.link(blob, tmp)
+            os.rename(tmp, dest)
+
+    def collect_blobs(self):
+        """Remove the local blobs no generation links to anymore."""
+        for dirpath, dirnames, filenames in os.walk(
+                os.path.join(self.build_root, '.blobs')):
+            for name in filenames:
+                blob = os.path.join(dirpath, name)
+                stat = os.stat(blob)
+                if stat.st_nlink == 1 and \
+                        stat.st_mtime < time.time() - BLOB_GRACE:
+                    os.remove(blob)
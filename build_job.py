@@ -0,0 +1,493 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+import multiprocessing
+import os
+import re
+import subprocess
+import time
+import traceback
+
+import psycopg2
+
+from openerp import models, fields, api, _
+from openerp.exceptions import Warning
+
+from .wizard_do_doc import BUILD_LANG, BUILD_FMT, sharded_builds
+
+_logger = logging.getLogger(__name__)
+
+# Sphinx processes running at the same time in parallel builds
+MAX_PROCESSES = multiprocessing.cpu_count()
+# seconds between two checks of the running Sphinx processes
+POLL_INTERVAL = 2
+
+JOB_STATES = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+    ('cancelled', 'Cancelled'),
+]
+
+JOB_PHASES = [
+    ('checkout', 'Updating base documentation'),
+    ('prepare', 'Preparing sources'),
+    ('read', 'Reading documents'),
+    ('write', 'Writing documents'),
+    ('finish', 'Post-processing'),
+    ('done', 'Finished'),
+]
+
+
+class BuildCancelled(Exception):
+    """Raised inside a build whose job has been cancelled."""
+
+
+class BuildFailed(Exception):
+    """Raised when a Sphinx process of a build fails."""
+
+
+class BuildProgress(object):
+    """Sphinx event handlers reporting the progress of a build on its job.
+
+    Each report also tells whether the job has been cancelled meanwhile,
+    in which case the build is aborted with :class:`BuildCancelled`.
+    """
+
+    # minimum seconds between two reports
+    interval = 2
+
+    def __init__(self, job):
+        self.job = job
+        self.read = 0
+        self.written = 0
+        self.last_report = 0
+
+    def connect(self, app):
+        """Connect the handlers to a Sphinx application and return the
+        listener ids to disconnect them."""
+        return [
+            app.connect('env-before-read-docs', self.before_read),
+            app.connect('doctree-read', self.doctree_read),
+            app.connect('env-updated', self.env_updated),
+            app.connect('doctree-resolved', self.doctree_resolved),
+        ]
+
+    def report(self, force=False, **vals):
+        if not force and time.time() - self.last_report < self.interval:
+            return
+        self.last_report = time.time()
+        vals.update(docs_read=self.read, docs_written=self.written)
+        self.job._report(**vals)
+
+    def before_read(self, app, env, docnames):
+        self.report(force=True, phase='read', docs_total=len(docnames))
+
+    def doctree_read(self, app, doctree):
+        self.read += 1
+        self.report()
+
+    def env_updated(self, app, env):
+        self.report(force=True, phase='write')
+
+    def doctree_resolved(self, app, doctree, docname):
+        self.written += 1
+        self.report()
+
+
+class SphinxProcess(object):
+    """A Sphinx build running in a process of its own.
+
+    Its output goes to a log file, which is parsed to report the progress
+    on the job.
+    """
+
+    progress_re = re.compile(
+        r'^(reading sources|writing output)\.\.\. \[\s*(\d+)%\]',
+        re.MULTILINE)
+    outdated_re = re.compile(r'(\d+) added, (\d+) changed, \d+ removed')
+
+    def __init__(self, job, command, log_path):
+        self.job = job
+        self.log_path = log_path
+        self.started = time.time()
+        self.offset = 0
+        self.total = 0
+        with open(log_path, 'w') as log:
+            self.process = subprocess.Popen(command, stdout=log,
+                                            stderr=subprocess.STDOUT,
+                                            close_fds=True)
+
+    def report(self):
+        """Report the progress logged since the last call."""
+        with open(self.log_path) as log:
+            log.seek(self.offset)
+            output = log.read()
+            self.offset = log.tell()
+        vals = {}
+        for match in self.outdated_re.finditer(output):
+            self.total = int(match.group(1)) + int(match.group(2))
+            vals['docs_total'] = self.total
+        for match in self.progress_re.finditer(output):
+            done = self.total * int(match.group(2)) // 100
+            if match.group(1) == 'reading sources':
+                vals.update(phase='read', docs_read=done)
+            else:
+                vals.update(phase='write', docs_written=done)
+        self.job._report(**vals)
+
+    def terminate(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def tail(self, size=4096):
+        """Return the end of the output of the build."""
+        with open(self.log_path) as log:
+            log.seek(max(os.path.getsize(self.log_path) - size, 0))
+            return log.read()
+
+
+class DochelpBuildJob(models.Model):
+    _name = 'dochelp.build.job'
+    _description = 'Documentation build'
+    _order = 'id desc'
+
+    name = fields.Char(compute='_compute_name')
+    build_lang = fields.Selection(string="Lang", required=True,
+                                  selection=BUILD_LANG, readonly=True)
+    build_fmt = fields.Selection(string="Format", required=True,
+                                 selection=BUILD_FMT, readonly=True)
+    module = fields.Char(string="Module", readonly=True,
+                         help="Only the PDF of the documentation of this "
+                              "module is built.")
+    state = fields.Selection(JOB_STATES, string="State", required=True,
+                             default='queued', readonly=True)
+    phase = fields.Selection(JOB_PHASES, string="Phase", readonly=True)
+    docs_total = fields.Integer(string="Documents to read", readonly=True)
+    docs_read = fields.Integer(string="Documents read", readonly=True)
+    docs_written = fields.Integer(string="Documents written", readonly=True)
+    progress = fields.Float(compute='_compute_progress')
+    user_id = fields.Many2one('res.users', string="Requested by",
+                              default=lambda self: self.env.user,
+                              readonly=True)
+    date_start = fields.Datetime(string="Started", readonly=True)
+    date_end = fields.Datetime(string="Finished", readonly=True)
+    error = fields.Text(string="Error", readonly=True)
+    report = fields.Text(string="Build report", readonly=True,
+                         help="Timings of every step of the build, metadata "
+                              "requests and slowest documents, as JSON.")
+
+    @api.multi
+    @api.depends('build_lang', 'build_fmt', 'module')
+    def _compute_name(self):
+        for job in self:
+            job.name = '%s/%s' % (job.build_lang, job.build_fmt)
+            if job.module:
+                job.name += '/%s' % job.module
+
+    @api.multi
+    @api.depends('phase', 'docs_total', 'docs_read', 'docs_written')
+    def _compute_progress(self):
+        for job in self:
+            if job.phase == 'done':
+                job.progress = 100.0
+            elif job.docs_total:
+                # reading and writing account for half of the build each
+                job.progress = 50.0 * (job.docs_read + job.docs_written) / \
+                    job.docs_total
+            else:
+                job.progress = 0.0
+
+    def init(self, cr):
+        # A single pending job per target, even when two are queued at
+        # the same time, as they would be built in the same workspace.
+        cr.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s",
+                   ('dochelp_build_job_pending_uniq',))
+        if cr.fetchone():
+            return
+        cr.execute("""UPDATE dochelp_build_job SET state = 'cancelled'
+                      WHERE state IN ('queued', 'running') AND id NOT IN (
+                          SELECT max(id) FROM dochelp_build_job
+                          WHERE state IN ('queued', 'running')
+                          GROUP BY build_lang, build_fmt,
+                                   coalesce(module, ''))""")
+        cr.execute("""CREATE UNIQUE INDEX dochelp_build_job_pending_uniq
+                      ON dochelp_build_job (build_lang, build_fmt,
+                                            coalesce(module, ''))
+                      WHERE state IN ('queued', 'running')""")
+
+    @api.model
+    def enqueue(self, build_lang, build_fmt, module=False):
+        """Queue a build of a target, or of the PDF of ``module`` only,
+        unless one is already pending."""
+        job = self.search([('build_lang', '=', build_lang),
+                           ('build_fmt', '=', build_fmt),
+                           ('module', '=', module),
+                           ('state', 'in', ('queued', 'running'))], limit=1)
+        if not job:
+            try:
+                with self.env.cr.savepoint():
+                    job = self.create({'build_lang': build_lang,
+                                       'build_fmt': build_fmt,
+                                       'module': module})
+            except psycopg2.IntegrityError:
+                # queued meanwhile by a concurrent transaction, which this
+                # one cannot see yet
+                raise Warning(_('A build of %s/%s is already pending.') % (
+                    build_lang, build_fmt))
+        return job
+
+    @api.multi
+    def action_cancel(self):
+        self._update_status({'state': 'cancelled',
+                             'date_end': fields.Datetime.now()},
+                            states=('queued', 'running'))
+        return True
+
+    @api.multi
+    def action_refresh(self):
+        return True
+
+    @api.multi
+    def _update_status(self, vals, states=('running',)):
+        """Write ``vals`` on the jobs in one of ``states`` with a cursor of
+        its own, so that it is visible while the build transaction is still
+        open.  Return whether any job was updated.
+        """
+        with self.pool.cursor() as cr:
+            jobs = self.with_env(self.env(cr=cr)).search(
+                [('id', 'in', self.ids), ('state', 'in', list(states))])
+            jobs.write(vals)
+            return bool(jobs)
+
+    @api.multi
+    def connect_progress(self, app):
+        """Report the progress of the Sphinx build of ``app`` on the job.
+
+        Return the listener ids to disconnect from the application.
+        """
+        self.ensure_one()
+        return BuildProgress(self).connect(app)
+
+    @api.multi
+    def _report(self, **vals):
+        """Report the progress of a running job and abort its build if it
+        has been cancelled."""
+        if not self._update_status(vals):
+            raise BuildCancelled()
+
+    @api.multi
+    def _run(self):
+        self.ensure_one()
+        if not self._update_status({'state': 'running',
+                                    'date_start': fields.Datetime.now()},
+                                   states=('queued',)):
+            return
+        wizard = self.env['dochelp.wizard.doc'].create({
+            'build_lang': self.build_lang,
+            'build_fmt': self.build_fmt,
+        })
+        try:
+            if self.module:
+                wizard.run_module_pdf(self.module, job=self)
+            elif wizard.is_sharded():
+                self._build_sharded(wizard)
+            else:
+                wizard.run_build(job=self)
+            report = wizard.build_report()
+        except BuildCancelled:
+            self.env.cr.rollback()
+            _logger.info('Documentation build %s cancelled', self.name)
+            return
+        except Exception:
+            self.env.cr.rollback()
+            _logger.exception('Documentation build %s failed', self.name)
+            self._update_status({'state': 'failed',
+                                 'date_end': fields.Datetime.now(),
+                                 'error': traceback.format_exc()})
+            return
+        self._update_status({'state': 'done', 'phase': 'done',
+                             'date_end': fields.Datetime.now(),
+                             'report': report})
+
+    @api.multi
+    def _build_sharded(self, wizard):
+        """Build the base documentation, then the documentation of every
+        module as a shard of its own, in parallel processes.
+
+        A shard is started once the shards it links to are built, so that
+        its references to them are resolved with their fresh inventories.
+        The progress of the job counts the finished Sphinx projects.
+        """
+        wizard.prepare_build(job=self)
+        signature = wizard.warm_metadata_cache()
+        # the base documentation is keyed by None
+        pending = [(None, set())]
+        pending.extend((module, set(deps) | {None})
+                       for module, deps in wizard.get_shards().items())
+        self._report(phase='read', docs_total=len(pending), docs_read=0,
+                     docs_written=0)
+        finished = set()
+        running = []
+        start = time.time()
+        try:
+            while pending or running:
+                for shard, deps in list(pending):
+                    if len(running) >= MAX_PROCESSES:
+                        break
+                    if deps <= finished:
+                        pending.remove((shard, deps))
+                        running.append((shard, SphinxProcess(
+                            self, wizard.get_sphinx_command(signature, shard),
+                            wizard.get_log_path(shard))))
+                time.sleep(POLL_INTERVAL)
+                for shard, process in list(running):
+                    returncode = process.process.poll()
+                    if returncode is None:
+                        continue
+                    running.remove((shard, process))
+                    if returncode:
+                        raise BuildFailed('Build of %s failed:\n%s' % (
+                            shard or 'the base documentation',
+                            process.tail()))
+                    finished.add(shard)
+                self._report(docs_read=len(finished),
+                             docs_written=len(finished))
+        finally:
+            for shard, process in running:
+                process.terminate()
+        wizard.add_timing('sphinx', time.time() - start)
+        wizard.merge_shards()
+        wizard.finish_build()
+
+    @api.multi
+    def _run_parallel(self):
+        """Run several builds at once.
+
+        The sources of every target are prepared here and the metadata
+        they reference is stored in the persistent cache, so each Sphinx
+        process reads it from there instead of calling Odoo.
+        """
+        pending = []
+        wizards = {}
+        for job in self:
+            if not job._update_status({'state': 'running',
+                                       'date_start': fields.Datetime.now()},
+                                      states=('queued',)):
+                continue
+            wizard = self.env['dochelp.wizard.doc'].create({
+                'build_lang': job.build_lang,
+                'build_fmt': job.build_fmt,
+            })
+            try:
+                wizard.prepare_build(job=job)
+                signature = wizard.warm_metadata_cache()
+            except BuildCancelled:
+                continue
+            except Exception:
+                _logger.exception('Documentation build %s failed', job.name)
+                job._update_status({'state': 'failed',
+                                    'date_end': fields.Datetime.now(),
+                                    'error': traceback.format_exc()})
+                continue
+            wizards[job.id] = wizard
+            pending.append((job, wizard.get_sphinx_command(signature),
+                            wizard.get_log_path()))
+        running = []
+        try:
+            while pending or running:
+                while pending and len(running) < MAX_PROCESSES:
+                    running.append(SphinxProcess(*pending.pop(0)))
+                time.sleep(POLL_INTERVAL)
+                for process in list(running):
+                    try:
+                        process.report()
+                    except BuildCancelled:
+                        _logger.info('Documentation build %s cancelled',
+                                     process.job.name)
+                        process.terminate()
+                        running.remove(process)
+                        continue
+                    returncode = process.process.poll()
+                    if returncode is None:
+                        continue
+                    running.remove(process)
+                    job = process.job
+                    if returncode:
+                        job._update_status({
+                            'state': 'failed',
+                            'date_end': fields.Datetime.now(),
+                            'error': process.tail(),
+                        })
+                        continue
+                    wizard = wizards[job.id]
+                    wizard.add_timing('sphinx', time.time() - process.started)
+                    try:
+                        wizard.finish_build()
+                        report = wizard.build_report()
+                    except BuildCancelled:
+                        continue
+                    except Exception:
+                        _logger.exception('Documentation build %s failed',
+                                          job.name)
+                        job._update_status({'state': 'failed',
+                                            'date_end': fields.Datetime.now(),
+                                            'error': traceback.format_exc()})
+                        continue
+                    job._update_status({
+                        'state': 'done',
+                        'phase': 'done',
+                        'date_end': fields.Datetime.now(),
+                        'report': report,
+                    })
+        finally:
+            # builds left running by an unexpected error
+            for process in running:
+                process.terminate()
+
+    @api.model
+    def _cron_run_jobs(self):
+        """Run the queued builds, all of them in parallel when there are
+        several, unless every build already runs its shards in parallel."""
+        # Only one instance of the cron runs at a time, so a job still
+        # running here was interrupted by a server stop.
+        self.search([('state', '=', 'running')])._update_status({
+            'state': 'failed',
+            'date_end': fields.Datetime.now(),
+            'error': _('Interrupted'),
+        })
+        while True:
+            jobs = self.search([('state', '=', 'queued')], order='id')
+            if not jobs:
+                break
+            pdf_jobs = jobs.filtered('module')
+            if pdf_jobs:
+                # the PDF of a single module is requested by a reader
+                pdf_jobs[0]._run()
+            elif len(jobs) == 1 or sharded_builds(self.env):
+                jobs[0]._run()
+            else:
+                jobs._run_parallel()
+            self.env.cr.commit()
+            self.invalidate_cache()
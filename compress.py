@@ -0,0 +1,134 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Precompressed variants of the built documentation files.
+
+Every compressible file gets a ``.gz`` sibling and, when the brotli
+package is installed, a ``.br`` one, so that nothing is compressed while
+serving.
+"""
+
+import gzip
+import logging
+import os
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.txt',
+                           '.xml', '.map', '.ico', '.ttf', '.eot')
+# Smaller files gain nothing from compression
+MIN_SIZE = 256
+
+# Content-Encoding of each variant, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+SUFFIXES = dict(ENCODINGS)
+
+
+def is_compressible(filename):
+    return filename.endswith(COMPRESSIBLE_EXTENSIONS)
+
+
+def _gzip(data):
+    buf = BytesIO()
+    # a fixed mtime keeps the variant identical from a build to the next
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _compressors():
+    compressors = [('.gz', _gzip)]
+    if brotli is not None:
+        compressors.append(('.br', brotli.compress))
+    return compressors
+
+
+def precompress(folder):
+    """Write the missing or outdated variants of the files of ``folder``
+    and remove the ones whose file is gone. Return the number of files
+    written."""
+    written = 0
+    suffixes = tuple(suffix for encoding, suffix in ENCODINGS)
+    compressors = _compressors()
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            if name.endswith(suffixes):
+                # other archives, such as downloads, are not variants
+                if is_compressible(name[:-3]) and \
+                        not os.path.exists(filename[:-3]):
+                    os.remove(filename)
+                continue
+            if not is_compressible(name):
+                continue
+            stat = os.stat(filename)
+            data = None
+            for suffix, compress in compressors:
+                variant = filename + suffix
+                if stat.st_size < MIN_SIZE:
+                    if os.path.exists(variant):
+                        os.remove(variant)
+                    continue
+                if os.path.exists(variant) and \
+                        os.path.getmtime(variant) >= stat.st_mtime:
+                    continue
+                if data is None:
+                    with open(filename, 'rb') as f:
+                        data = f.read()
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    if os.path.exists(variant):
+                        os.remove(variant)
+                    continue
+                with open(variant, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    _logger.info('%d precompressed files written in %s', written, folder)
+    return written
+
+
+def accepted_encodings(httprequest):
+    """Return the encodings of the variants accepted by the client, the
+    best one first."""
+    accepted = []
+    for index, (encoding, suffix) in enumerate(ENCODINGS):
+        quality = httprequest.accept_encodings[encoding]
+        if quality > 0:
+            accepted.append((-quality, index, encoding))
+    return tuple(encoding for quality, index, encoding in sorted(accepted))
+
+
+def select_variant(filename, encodings):
+    """Return the first variant of ``filename`` existing in one of
+    ``encodings``, as a ``(filename, encoding)`` tuple. ``encoding`` is None
+    when the file itself must be sent."""
+    for encoding in encodings:
+        variant = filename + SUFFIXES[encoding]
+        if os.path.isfile(variant):
+            return variant, encoding
+    return filename, None
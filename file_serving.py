@@ -0,0 +1,359 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Serving of the built documentation files.
+
+Only depends on Werkzeug, so that it can be exercised without Odoo.
+"""
+
+import datetime
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.http import is_resource_modified, parse_range_header
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+from .compress import accepted_encodings, is_compressible, select_variant
+
+# Pages must be revalidated quickly to show a new build
+HTML_MAXAGE = 10
+# Other assets keep their name from a build to the next one
+ASSET_MAXAGE = 60 * 60
+
+CHUNK_SIZE = 64 * 1024
+
+# Bytes of pages kept in memory by each server process
+PAGE_CACHE_SIZE = 32 * 1024 * 1024
+# Larger files are always streamed from the disk
+PAGE_MAX_SIZE = 512 * 1024
+# Seconds between two checks of the published generation
+GENERATION_CHECK_INTERVAL = 1
+
+# Written in the build folder each time a build is published
+GENERATION_FILE = '.generation'
+# Generation each file of a published build was first published in
+MANIFEST_FILE = '_manifest.json'
+
+# content digests by (filename, mtime, size)
+_etags = {}
+_ETAGS_SIZE = 10000
+
+# manifests by generation folder
+_manifests = {}
+_MANIFESTS_SIZE = 32
+
+
+def resolve_path(root, xpath):
+    """Return the file ``xpath`` points to inside ``root``, or None when
+    the path escapes it."""
+    root = os.path.abspath(root)
+    filename = os.path.normpath(os.path.join(root, xpath))
+    if not filename.startswith(root + os.sep):
+        return None
+    return filename
+
+
+def file_etag(filename, stat):
+    """Return a digest of the content of a file, computed once for each
+    version of the file."""
+    key = (filename, stat.st_mtime, stat.st_size)
+    etag = _etags.get(key)
+    if etag is None:
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        etag = digest.hexdigest()
+        if len(_etags) >= _ETAGS_SIZE:
+            _etags.clear()
+        _etags[key] = etag
+    return etag
+
+
+def read_manifest(folder):
+    """Return the manifest of a generation folder, read once."""
+    manifest = _manifests.get(folder)
+    if manifest is None:
+        try:
+            with open(os.path.join(folder, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            manifest = {}
+        if len(_manifests) >= _MANIFESTS_SIZE:
+            _manifests.clear()
+        _manifests[folder] = manifest
+    return manifest
+
+
+def generation_etag(folder, filename, encoding=None):
+    """Return an ETag made of the generation the content of ``filename``
+    was first published in, or None when ``folder`` has no manifest."""
+    rel = os.path.relpath(filename, folder).replace(os.sep, '/')
+    generation = read_manifest(folder).get(rel)
+    if generation is None:
+        return None
+    if encoding:
+        return 'g%d-%s' % (generation, encoding)
+    return 'g%d' % generation
+
+
+def cache_control(xpath):
+    if xpath.endswith('.html'):
+        return 'public, max-age=%d, must-revalidate' % HTML_MAXAGE
+    return 'public, max-age=%d' % ASSET_MAXAGE
+
+
+class FileSlice(object):
+    """Iterates over ``length`` bytes of an open file and closes it."""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.length = length
+
+    def __iter__(self):
+        remaining = self.length
+        while remaining > 0:
+            chunk = self.f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.f.close()
+
+
+def read_generation(root):
+    """Return the generation of the builds published in ``root``."""
+    try:
+        with open(os.path.join(root, GENERATION_FILE)) as f:
+            return int(f.read().strip() or 0)
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def publish(root):
+    """Start a new generation of the builds of ``root``, so that the
+    pages cached by every server process are dropped."""
+    generation = read_generation(root) + 1
+    tmp = os.path.join(root, '%s.%d' % (GENERATION_FILE, os.getpid()))
+    with open(tmp, 'w') as f:
+        f.write('%d\n' % generation)
+    os.rename(tmp, os.path.join(root, GENERATION_FILE))
+    return generation
+
+
+class Page(object):
+    """What is needed to answer a request for a file, with its content
+    when it is small enough to be kept in memory."""
+
+    __slots__ = ('filename', 'encoding', 'etag', 'last_modified', 'size',
+                 'body')
+
+    def __init__(self, filename, encoding, etag, last_modified, size,
+                 body=None):
+        self.filename = filename
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+        self.body = body
+
+    @classmethod
+    def load(cls, filename, encoding, max_size=PAGE_MAX_SIZE, etag=None):
+        stat = os.stat(filename)
+        body = None
+        if stat.st_size <= max_size:
+            with open(filename, 'rb') as f:
+                body = f.read()
+        return cls(filename, encoding, etag or file_etag(filename, stat),
+                   datetime.datetime.utcfromtimestamp(int(stat.st_mtime)),
+                   stat.st_size, body)
+
+
+class PageCache(object):
+    """Size-bounded LRU cache of the pages served from ``root``.
+
+    The whole cache is dropped when a new generation is published in
+    ``root``, which is checked at most once per
+    :data:`GENERATION_CHECK_INTERVAL`, so hot pages are served without
+    touching the disk.
+    """
+
+    def __init__(self, root, size=PAGE_CACHE_SIZE,
+                 check_interval=GENERATION_CHECK_INTERVAL):
+        self.root = root
+        self.size = size
+        self.check_interval = check_interval
+        self._pages = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = None
+        self._checked = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_generation(self):
+        now = time.time()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        generation = read_generation(self.root)
+        if generation != self._generation:
+            if self._generation is not None:
+                self.invalidations += 1
+            self._generation = generation
+            self._pages.clear()
+            self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            self._check_generation()
+            page = self._pages.pop(key, None)
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages[key] = page
+            self.hits += 1
+            return page
+
+    def set(self, key, page):
+        if page.body is None:
+            return
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._pages[key] = page
+            self._bytes += len(page.body)
+            while self._bytes > self.size:
+                key, old = self._pages.popitem(last=False)
+                self._bytes -= len(old.body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'generation': self._generation,
+                'entries': len(self._pages),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+def serve_file(httprequest, filename, xpath, mimetype=None, cache=None,
+               root=None):
+    """Return a response with the content of ``filename``.
+
+    Responses carry a strong ETag on the content, honour conditional and
+    Range requests, and are cached according to the kind of file.  The
+    best precompressed variant accepted by the client is sent instead of
+    the file when there is one.  Small files are kept in ``cache`` and sent
+    from memory, larger ones are streamed from the disk.
+
+    When ``root`` is a published generation, the file is read from the
+    generation it points to when the request is answered, even if another
+    one is published meanwhile, and its ETag is the generation its
+    content was first published in.
+
+    :param httprequest: Werkzeug request
+    :param str filename: file to send
+    :param str xpath: path of the file in the URL
+    :param str mimetype: type of the content, guessed from ``xpath`` if
+        not given
+    :param PageCache cache: cache of the pages of the folder of the file
+    :param str root: served folder ``filename`` is in
+    :rtype: werkzeug.wrappers.Response
+    """
+    environ = httprequest.environ
+    headers = [
+        ('Cache-Control', cache_control(xpath)),
+        ('Accept-Ranges', 'bytes'),
+    ]
+    encodings = ()
+    if is_compressible(filename):
+        headers.append(('Vary', 'Accept-Encoding'))
+        encodings = accepted_encodings(httprequest)
+    key = (filename, encodings)
+    page = cache.get(key) if cache is not None else None
+    if page is None:
+        etag = None
+        if root is not None:
+            folder = os.path.realpath(root)
+            filename = os.path.join(folder, os.path.relpath(filename, root))
+        variant, encoding = select_variant(filename, encodings)
+        if root is not None:
+            etag = generation_etag(folder, variant, encoding)
+        page = Page.load(variant, encoding, etag=etag)
+        if cache is not None:
+            cache.set(key, page)
+    if page.encoding:
+        headers.append(('Content-Encoding', page.encoding))
+    mimetype = mimetype or mimetypes.guess_type(xpath)[0] or \
+        'application/octet-stream'
+    response = Response(headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+
+    if not is_resource_modified(environ, page.etag,
+                                last_modified=page.last_modified):
+        response.status_code = 304
+        return response
+
+    size = page.size
+    byte_range = None
+    if_range = environ.get('HTTP_IF_RANGE')
+    if 'HTTP_RANGE' in environ and (not if_range or
+                                    if_range.strip('"') == page.etag):
+        byte_range = parse_range_header(environ['HTTP_RANGE'])
+        bounds = byte_range and byte_range.range_for_length(size)
+        if byte_range is not None and bounds is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = 'bytes */%d' % size
+            return response
+        byte_range = bounds
+
+    start, stop = byte_range or (0, size)
+    if byte_range:
+        response.status_code = 206
+        response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+            start, stop - 1, size)
+    response.content_length = stop - start
+    if page.body is not None:
+        response.response = [page.body[start:stop]]
+        return response
+    f = open(page.filename, 'rb')
+    if byte_range:
+        f.seek(start)
+        response.response = FileSlice(f, stop - start)
+    else:
+        # lets the WSGI server use sendfile when it supports it
+        response.response = wrap_file(environ, f)
+    return response
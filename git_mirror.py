@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Local mirror of the base documentation repository.
+
+The mirror is fetched incrementally and every build target gets its own
+worktree of it, checked out at a pinned commit.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+from git import Repo
+
+_logger = logging.getLogger(__name__)
+
+
+def mirror_path(root, url):
+    """Return the folder of the mirror of ``url`` inside ``root``."""
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(root, '%s.git' % digest[:16])
+
+
+@contextmanager
+def locked(mirror):
+    """Serialize the git operations done on a mirror by several builds."""
+    directory = os.path.dirname(mirror)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(mirror + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def update_mirror(url, mirror):
+    """Create the mirror of ``url`` or fetch what changed since the last
+    update, and return its :class:`git.Repo`."""
+    with locked(mirror):
+        if os.path.isdir(mirror):
+            repo = Repo(mirror)
+            repo.git.fetch('--prune', 'origin')
+        else:
+            _logger.info('Cloning %s into %s', url, mirror)
+            repo = Repo.clone_from(url, mirror, mirror=True)
+    return repo
+
+
+def checkout(repo, worktree, ref):
+    """Check out ``ref`` of a mirror in ``worktree`` and return the
+    pinned commit.
+
+    An existing worktree is moved to the new commit in place, so the
+    files that did not change keep their modification time.
+    """
+    commit = repo.commit(ref).hexsha
+    with locked(repo.git_dir):
+        if os.path.isdir(os.path.join(worktree, '.git')):
+            # standalone clone made by a previous version of the module
+            shutil.rmtree(worktree)
+        if os.path.isfile(os.path.join(worktree, '.git')):
+            Repo(worktree).git.checkout('-f', '--detach', commit)
+        else:
+            if os.path.exists(worktree):
+                shutil.rmtree(worktree)
+            repo.git.worktree('prune')
+            repo.git.worktree('add', '--detach', worktree, commit)
+    # the modification time of the folder tells when it was last used
+    os.utime(worktree, None)
+    return commit
+
+
+def collect_garbage(repo, max_age):
+    """Remove the worktrees not used for ``max_age`` seconds."""
+    limit = time.time() - max_age
+    with locked(repo.git_dir):
+        for line in repo.git.worktree('list', '--porcelain').splitlines():
+            if not line.startswith('worktree '):
+                continue
+            worktree = line[len('worktree '):]
+            if worktree.rstrip('/') == repo.git_dir.rstrip('/'):
+                continue
+            if os.path.isdir(worktree) and os.path.getmtime(worktree) < limit:
+                _logger.info('Removing unused checkout %s', worktree)
+                shutil.rmtree(worktree)
+        repo.git.worktree('prune')
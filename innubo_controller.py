@@ -21,36 +21,61 @@
 ##############################################################################
 
 from openerp import http
+from openerp.exceptions import Warning
 from openerp.http import request
+import json
 import os
-import datetime
-import mimetypes
+import re
+import werkzeug
 
-# BUNDLE_MAXAGE = 60 * 60 * 24 * 7
-BUNDLE_MAXAGE = 10
+from . import blob_store, file_serving
+from ._extensions import dochelp_search
+from ._extensions.odoodoc.lookup import LOOKUP_FILENAME, LookupTable
+from .wizard_do_doc import BUILD_LANG, get_blob_store, get_pdf_cache
 
+# Language served when the path does not start with one
+DEFAULT_LANG = BUILD_LANG[0][0]
 
-def make_conditional(response, last_modified=None, etag=None, max_age=0):
-    """ Makes the provided response conditional based upon the request,
-    and mandates revalidation from clients
+BUILD_ROOT = os.path.join(os.path.dirname(__file__), 'build')
 
-    Uses Werkzeug's own :meth:`ETagResponseMixin.make_conditional`, after
-    setting ``last_modified`` and ``etag`` correctly on the response object
+# Hot pages of every language, dropped when a build is published
+_page_cache = file_serving.PageCache(BUILD_ROOT)
 
-    :param response: Werkzeug response
-    :type response: werkzeug.wrappers.Response
-    :param datetime.datetime last_modified: last modification date of the response content
-    :param str etag: some sort of checksum of the content (deep etag)
-    :return: the response object provided
-    :rtype: werkzeug.wrappers.Response
-    """
-    response.cache_control.must_revalidate = True
-    response.cache_control.max_age = max_age
-    if last_modified:
-        response.last_modified = last_modified
-    if etag:
-        response.set_etag(etag)
-    return response.make_conditional(request.httprequest)
+# Readers of the search index of each language
+_search_indexes = {}
+
+# Context-sensitive help targets of each language
+_lookup_tables = dict(
+    (lang, LookupTable(os.path.join(BUILD_ROOT, lang, 'html',
+                                    LOOKUP_FILENAME)))
+    for lang, name in BUILD_LANG)
+
+# Results returned by a search when no limit is given
+SEARCH_LIMIT = 20
+
+# Seconds before the page of a PDF being built reloads
+PDF_RETRY = 15
+
+PDF_BUILDING_HTML = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8" />
+<meta http-equiv="refresh" content="%(retry)d" />
+<title>%(module)s</title></head>
+<body><p>The PDF of the documentation of <b>%(module)s</b> is being built.
+This page reloads until it is ready.</p></body></html>
+'''
+
+_module_re = re.compile(r'^\w+$')
+
+# Builds published by other nodes, fetched from the shared store on demand
+_store = get_blob_store()
+_node_cache = _store and blob_store.NodeCache(_store, BUILD_ROOT)
+
+
+def fetch(lang, xpath):
+    """Make sure a file of the HTML build of ``lang`` is on this node, when
+    builds are shared with other nodes."""
+    if _node_cache is not None:
+        _node_cache.fetch('%s/html' % lang, xpath)
 
 
 class DocHelp(http.Controller):
@@ -59,14 +84,101 @@ class DocHelp(http.Controller):
         '/dochelp',
         '/dochelp/<path:xpath>'], type='http', auth='none')
     def dochelp(self, xpath=None, **kw):
-        s = os.path.dirname(__file__)
+        lang = DEFAULT_LANG
+        if xpath:
+            parts = xpath.split('/', 1)
+            if parts[0] in dict(BUILD_LANG):
+                lang = parts[0]
+                xpath = len(parts) > 1 and parts[1] or None
         if xpath is None:
             xpath = 'index.html'
-        ss = os.path.join(s, 'build', 'html', xpath)
-        f = open(ss)
-        t = os.path.getmtime(ss)
-        last_modified = datetime.datetime.fromtimestamp(t)
-        mimetype = mimetypes.guess_type(xpath)[0]
-        ret = f.read()
-        response = request.make_response(ret, [('Content-Type', mimetype)])
-        return make_conditional(response, last_modified, max_age=BUNDLE_MAXAGE)
+        root = os.path.join(BUILD_ROOT, lang, 'html')
+        ss = file_serving.resolve_path(root, xpath)
+        if ss is None:
+            return request.not_found()
+        try:
+            fetch(lang, os.path.relpath(ss, root))
+            return file_serving.serve_file(request.httprequest, ss, xpath,
+                                           cache=_page_cache, root=root)
+        except (IOError, OSError):
+            return request.not_found()
+
+    @http.route('/dochelp/search', type='http', auth='none')
+    def search(self, q='', lang=DEFAULT_LANG, limit=SEARCH_LIMIT, **kw):
+        try:
+            limit = max(1, min(int(limit), 100))
+        except ValueError:
+            return request.not_found()
+        if lang not in dict(BUILD_LANG):
+            return request.not_found()
+        index = _search_indexes.get(lang)
+        if index is None:
+            index = _search_indexes[lang] = dochelp_search.open_index(
+                os.path.join(BUILD_ROOT, lang, 'html',
+                             dochelp_search.INDEX_FILENAME))
+        try:
+            fetch(lang, dochelp_search.INDEX_FILENAME)
+            results = index.search(q, limit=limit)
+        except (IOError, OSError):
+            # not built yet
+            results = []
+        for result in results:
+            result['url'] = '/dochelp/%s/%s' % (lang, result['uri'])
+        return request.make_response(
+            json.dumps({'query': q, 'results': results}),
+            [('Content-Type', 'application/json')])
+
+    @http.route('/dochelp/lookup', type='http', auth='none')
+    def lookup(self, model=None, field=None, menu=None, lang=DEFAULT_LANG,
+               **kw):
+        """Redirect to the section documenting a field, a model or a menu
+        (given by its xmlid)."""
+        table = _lookup_tables.get(lang)
+        if table:
+            try:
+                fetch(lang, LOOKUP_FILENAME)
+            except (IOError, OSError):
+                return request.not_found()
+        uri = table and table.find(model=model, field=field, menu=menu)
+        if not uri:
+            return request.not_found()
+        return werkzeug.utils.redirect('/dochelp/%s/%s' % (lang, uri), 303)
+
+    @http.route('/dochelp/pdf/<string:module>.pdf', type='http',
+                auth='user')
+    def pdf(self, module, lang=DEFAULT_LANG, **kw):
+        """Send the last PDF built of the documentation of a module, or
+        queue its build when there is none yet.
+
+        LaTeX builds compile the PDFs of the modules again when they are
+        outdated.
+        """
+        if lang not in dict(BUILD_LANG) or not _module_re.match(module):
+            return request.not_found()
+        filename = get_pdf_cache(request.db, lang).current(module)
+        if not filename:
+            if not request.env['dochelp.module.doc'].sudo().search(
+                    [('name', '=', module), ('lang', '=', lang)]):
+                return request.not_found()
+            try:
+                request.env['dochelp.build.job'].sudo().enqueue(
+                    lang, 'latex', module=module)
+            except Warning:
+                # queued meanwhile by another request
+                pass
+            return werkzeug.wrappers.Response(
+                PDF_BUILDING_HTML % {'module': module, 'retry': PDF_RETRY},
+                status=202, mimetype='text/html',
+                headers=[('Retry-After', str(PDF_RETRY)),
+                         ('Cache-Control', 'no-cache')])
+        response = file_serving.serve_file(request.httprequest, filename,
+                                           '%s.pdf' % module)
+        response.headers['Content-Disposition'] = \
+            'inline; filename="%s.pdf"' % module
+        return response
+
+    @http.route('/dochelp/_cache_stats', type='http', auth='user')
+    def cache_stats(self, **kw):
+        return request.make_response(
+            json.dumps(_page_cache.stats()),
+            [('Content-Type', 'application/json')])
@@ -0,0 +1,144 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Index of the documentation of the installed modules.
+
+The addons paths are searched for documentation when modules are
+installed, upgraded or uninstalled, instead of by every build, and the
+builds tell the documentation that changed by its stored fingerprint.  A
+cron catches up with the modules installed from the command line.
+"""
+
+import hashlib
+import logging
+import os
+
+from openerp import SUPERUSER_ID, models, fields, api
+from openerp.modules.graph import Graph
+from openerp.modules.module import get_module_path
+
+from .wizard_do_doc import BUILD_LANG, tree_fingerprint
+
+_logger = logging.getLogger(__name__)
+
+# Digest of the installed modules at the last refresh of the index
+SIGNATURE_PARAM = 'dochelp.module_doc_signature'
+
+
+def installed_signature(modules):
+    """Return a digest of the name, version and write date of
+    ``modules``."""
+    digest = hashlib.sha1()
+    for module in sorted(modules, key=lambda m: m.name):
+        digest.update(('%s=%s@%s;' % (module.name, module.latest_version,
+                                      module.write_date)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class DochelpModuleDoc(models.Model):
+    _name = 'dochelp.module.doc'
+    _description = 'Module documentation'
+    _order = 'sequence, name, lang'
+
+    name = fields.Char(string="Module", required=True, readonly=True,
+                       index=True)
+    lang = fields.Selection(BUILD_LANG, string="Lang", required=True,
+                            readonly=True)
+    path = fields.Char(string="Folder", required=True, readonly=True)
+    sequence = fields.Integer(string="Dependency order", readonly=True,
+                              help="Modules come after the ones they depend "
+                                   "on.")
+    fingerprint = fields.Char(string="Fingerprint", readonly=True,
+                              help="Digest of the files of the folder when "
+                                   "the module was last installed or "
+                                   "upgraded.")
+    module_version = fields.Char(string="Module version", readonly=True)
+    module_date = fields.Datetime(string="Module updated", readonly=True)
+
+    _sql_constraints = [
+        ('name_lang_uniq', 'unique(name, lang)',
+         'A module has one documentation folder per language.'),
+    ]
+
+    @api.model
+    def refresh(self):
+        """Bring the index up to date with the installed modules.
+
+        Nothing is done unless modules were installed, upgraded or
+        uninstalled since the last refresh, and only the folders of the
+        modules whose version or record changed are fingerprinted again.
+        """
+        modules = self.env['ir.module.module'].search(
+            [('state', '=', 'installed')])
+        params = self.env['ir.config_parameter'].sudo()
+        signature = installed_signature(modules)
+        if params.get_param(SIGNATURE_PARAM) == signature:
+            return
+        installed = dict((module.name, module) for module in modules)
+        graph = Graph()
+        graph.add_modules(self._cr, list(installed))
+        existing = dict(((doc.name, doc.lang), doc) for doc in self.search([]))
+        for sequence, node in enumerate(graph):
+            module = installed[node.name]
+            module_path = get_module_path(node.name)
+            for lang, __ in BUILD_LANG:
+                doc = existing.pop((node.name, lang), None)
+                folder = module_path and os.path.join(module_path, 'doc', lang)
+                if not folder or not os.path.isdir(folder):
+                    if doc:
+                        doc.unlink()
+                    continue
+                vals = {
+                    'sequence': sequence,
+                    'path': folder,
+                    'module_version': module.latest_version,
+                    'module_date': module.write_date,
+                }
+                if not doc:
+                    vals['fingerprint'] = tree_fingerprint(folder)
+                    self.create(dict(vals, name=node.name, lang=lang))
+                elif any(doc[key] != value for key, value in vals.items()):
+                    # a new dependency order alone keeps the files
+                    if doc.path != folder or \
+                            doc.module_date != module.write_date or \
+                            doc.module_version != module.latest_version:
+                        vals['fingerprint'] = tree_fingerprint(folder)
+                    doc.write(vals)
+        # modules uninstalled or without documentation anymore
+        for doc in existing.values():
+            doc.unlink()
+        params.set_param(SIGNATURE_PARAM, signature)
+        _logger.info('Documentation index refreshed')
+
+
+class IrModuleModule(models.Model):
+    _inherit = 'ir.module.module'
+
+    def _button_immediate_function(self, cr, uid, ids, function,
+                                   context=None):
+        res = super(IrModuleModule, self)._button_immediate_function(
+            cr, uid, ids, function, context=context)
+        # the registry was loaded again with the modules installed,
+        # upgraded or uninstalled, and may lack this model now
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        if 'dochelp.module.doc' in env.registry:
+            env['dochelp.module.doc'].refresh()
+        return res
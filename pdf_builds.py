@@ -0,0 +1,211 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""PDFs of the documentation of each module.
+
+The documentation of every module is a LaTeX project of its own, compiled
+with latexmk.  The PDFs are cached under a hash of everything they are
+built from, so a module is only compiled again when its sources, the
+extensions, the configuration or the metadata of the database change.
+"""
+
+import fcntl
+import glob
+import hashlib
+import logging
+import multiprocessing
+import os
+import subprocess
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from .blob_store import atomic_copy
+
+_logger = logging.getLogger(__name__)
+
+LATEXMK_COMMAND = ['latexmk', '-pdf', '-interaction=nonstopmode',
+                   '-halt-on-error']
+# PDFs compiled at the same time
+MAX_PROCESSES = multiprocessing.cpu_count()
+
+
+class PdfBuildFailed(Exception):
+    """Raised when the PDF of a module cannot be built."""
+
+
+def pdf_key(*parts):
+    """Return the key of a PDF built from ``parts``."""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(('%s\0' % part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+@contextmanager
+def locked(filename):
+    """Serialize the builds of a PDF by several processes."""
+    with open(filename, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def tail(filename, size=4096):
+    """Return the end of a log file."""
+    with open(filename) as log:
+        log.seek(max(os.path.getsize(filename) - size, 0))
+        return log.read()
+
+
+class PdfCache(object):
+    """The last PDF built of each module, keyed by what it was built
+    from, and also published under the name of the module, so that it is
+    served without computing its key."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, module, key):
+        return os.path.join(self.folder, '%s.%s.pdf' % (module, key))
+
+    def current(self, module):
+        """Return the last PDF built of ``module``, or None."""
+        filename = os.path.join(self.folder, '%s.pdf' % module)
+        return filename if os.path.isfile(filename) else None
+
+    def get(self, module, key):
+        """Return the cached PDF of ``module`` built under ``key``, or
+        None."""
+        filename = self.path(module, key)
+        return filename if os.path.isfile(filename) else None
+
+    def put(self, module, key, filename):
+        """Cache the PDF ``filename`` of ``module`` and drop the ones built
+        under other keys."""
+        dest = self.path(module, key)
+        atomic_copy(filename, dest)
+        current = os.path.join(self.folder, '%s.pdf' % module)
+        tmp = '%s.%d.%d' % (current, os.getpid(),
+                            threading.current_thread().ident)
+        os.link(dest, tmp)
+        os.rename(tmp, current)
+        for other in glob.glob(self.path(module, '*')):
+            if other != dest:
+                os.remove(other)
+        return dest
+
+    def collect(self, modules):
+        """Remove the PDFs of the modules not in ``modules``."""
+        if not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            if name.endswith('.pdf') and name.split('.', 1)[0] not in modules:
+                os.remove(os.path.join(self.folder, name))
+
+    def lock(self, module):
+        if not os.path.isdir(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:
+                # created meanwhile by another process
+                pass
+        return locked(os.path.join(self.folder, '%s.lock' % module))
+
+
+class PdfTask(object):
+    """The commands building the PDF of a module, run in order, and the
+    PDF they write."""
+
+    def __init__(self, module, key, commands, pdf, log_path):
+        self.module = module
+        self.key = key
+        # (arguments, working directory) tuples
+        self.commands = commands
+        self.pdf = pdf
+        self.log_path = log_path
+
+
+def run_task(cache, task):
+    """Build and cache the PDF of a task, unless another process did it
+    meanwhile, and return it."""
+    with cache.lock(task.module):
+        cached = cache.get(task.module, task.key)
+        if cached:
+            return cached
+        with open(task.log_path, 'w') as log:
+            for args, cwd in task.commands:
+                try:
+                    returncode = subprocess.call(
+                        args, cwd=cwd, stdout=log, stderr=subprocess.STDOUT,
+                        close_fds=True)
+                except OSError as e:
+                    raise PdfBuildFailed('%s could not be run: %s' % (
+                        args[0], e))
+                if returncode:
+                    log.flush()
+                    raise PdfBuildFailed('PDF of %s failed:\n%s' % (
+                        task.module, tail(task.log_path)))
+        return cache.put(task.module, task.key, task.pdf)
+
+
+def build_pdfs(cache, tasks, processes=MAX_PROCESSES):
+    """Build the PDFs of ``tasks`` missing from ``cache``, in parallel.
+
+    Return the PDF of each module by name.  The PDFs built are cached even
+    when others fail, in which case :class:`PdfBuildFailed` is raised once
+    they are all done.
+    """
+    pdfs = {}
+    pending = []
+    for task in tasks:
+        cached = cache.get(task.module, task.key)
+        if cached:
+            pdfs[task.module] = cached
+        else:
+            pending.append(task)
+    if not pending:
+        return pdfs
+
+    def build(task):
+        try:
+            return task.module, run_task(cache, task), None
+        except PdfBuildFailed as e:
+            return task.module, None, str(e)
+
+    pool = ThreadPool(min(processes, len(pending)))
+    try:
+        results = pool.map(build, pending)
+    finally:
+        pool.terminate()
+    errors = []
+    for module, pdf, error in results:
+        if error:
+            errors.append(error)
+        else:
+            pdfs[module] = pdf
+    _logger.info('%d PDFs built, %d failed', len(pending) - len(errors),
+                 len(errors))
+    if errors:
+        raise PdfBuildFailed('\n\n'.join(errors))
+    return pdfs
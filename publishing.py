@@ -0,0 +1,179 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Atomic publishing of the HTML builds.
+
+Builds are written in a staging folder, copied into a new generation
+folder next to the served one and published by atomically pointing the
+served folder, a symbolic link, to it.  Requests never see a partial
+build, and the last generations are kept for the requests still reading
+them and for rollbacks.  Files that did not change are hard links to the
+ones of the previous generation.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+
+from .file_serving import MANIFEST_FILE, publish, read_manifest
+
+_logger = logging.getLogger(__name__)
+
+# Generations kept besides the published one
+KEEP_GENERATIONS = 3
+
+CHUNK_SIZE = 64 * 1024
+
+_generation_re = re.compile(r'^\d+$')
+
+
+def generations_folder(target):
+    """Return the folder of the generations of the served folder
+    ``target``."""
+    return target + '.generations'
+
+
+def list_generations(target):
+    """Return the generations of ``target``, the oldest first."""
+    folder = generations_folder(target)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(int(name) for name in os.listdir(folder)
+                  if _generation_re.match(name))
+
+
+def current_generation(target):
+    """Return the generation ``target`` points to, or None."""
+    if not os.path.islink(target):
+        return None
+    name = os.path.basename(os.readlink(target))
+    return int(name) if _generation_re.match(name) else None
+
+
+def same_content(filename, other):
+    """Whether two files have the same content.
+
+    Files of the same size are always compared byte by byte, as a file
+    rewritten within the same second may keep its size and mtime.
+    """
+    if os.path.getsize(filename) != os.path.getsize(other):
+        return False
+    with open(filename, 'rb') as f, open(other, 'rb') as g:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if chunk != g.read(CHUNK_SIZE):
+                return False
+            if not chunk:
+                return True
+
+
+def switch(target, generation):
+    """Atomically point the served folder ``target`` to ``generation``."""
+    link = os.path.join(os.path.basename(generations_folder(target)),
+                        str(generation))
+    tmp = '%s.%d' % (target, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(link, tmp)
+    if os.path.isdir(target) and not os.path.islink(target):
+        # written in place by a version not publishing generations
+        shutil.rmtree(target)
+    os.rename(tmp, target)
+
+
+def publish_generation(staging, target, root, keep=KEEP_GENERATIONS,
+                       minimum=0):
+    """Publish the build of ``staging`` as a new generation of ``target``
+    and return it.
+
+    :param root: folder of every served build, whose page caches are
+        dropped
+    :param keep: generations kept besides the published one
+    :param minimum: generation the new one must follow, besides the local
+        ones
+    """
+    folder = generations_folder(target)
+    generation = max(list_generations(target) + [minimum]) + 1
+    current = current_generation(target)
+    previous = current and os.path.join(folder, str(current))
+    previous_manifest = read_manifest(previous) if previous else {}
+    dest = os.path.join(folder, str(generation))
+    tmp = dest + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    manifest = {}
+    linked = 0
+    for dirpath, dirnames, filenames in os.walk(staging):
+        reldir = os.path.relpath(dirpath, staging)
+        os.makedirs(os.path.normpath(os.path.join(tmp, reldir)))
+        for name in filenames:
+            rel = os.path.normpath(os.path.join(reldir, name))
+            key = rel.replace(os.sep, '/')
+            filename = os.path.join(staging, rel)
+            old = previous and os.path.join(previous, rel)
+            if key in previous_manifest and os.path.isfile(old) and \
+                    same_content(filename, old):
+                os.link(old, os.path.join(tmp, rel))
+                manifest[key] = previous_manifest[key]
+                linked += 1
+            else:
+                shutil.copy2(filename, os.path.join(tmp, rel))
+                manifest[key] = generation
+    with open(os.path.join(tmp, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    os.rename(tmp, dest)
+    switch(target, generation)
+    # drops the pages cached by the server processes
+    publish(root)
+    _logger.info('Generation %d of %s published, %d of %d files unchanged',
+                 generation, target, linked, len(manifest))
+    collect_generations(target, keep)
+    return generation
+
+
+def rollback(target, root):
+    """Publish again the generation of ``target`` preceding the current
+    one and return it, or None when there is none."""
+    current = current_generation(target)
+    older = [generation for generation in list_generations(target)
+             if current is None or generation < current]
+    if not older:
+        return None
+    switch(target, older[-1])
+    publish(root)
+    return older[-1]
+
+
+def collect_generations(target, keep=KEEP_GENERATIONS):
+    """Remove the generations of ``target`` older than the last ``keep``
+    ones, besides the published one."""
+    current = current_generation(target)
+    folder = generations_folder(target)
+    others = [generation for generation in list_generations(target)
+              if generation != current]
+    for generation in others[:-keep] if keep else others:
+        shutil.rmtree(os.path.join(folder, str(generation)))
+    for name in os.listdir(folder):
+        if name.endswith('.tmp'):
+            # left by an interrupted publication
+            shutil.rmtree(os.path.join(folder, name))
@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Copyright (c) 2011-TODAY MINORISA (http://www.minorisa.net)
+#                             All Rights Reserved.
+#                             Minorisa <contact@minorisa.net>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Warm Sphinx applications kept between builds.
+
+Creating a Sphinx application loads every extension and unpickles the
+environment, so the applications of the last built targets are kept.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from sphinx.application import Sphinx
+
+_logger = logging.getLogger(__name__)
+
+
+def config_digest(confdir):
+    """Return a digest of the ``conf.py`` file of ``confdir``."""
+    with open(os.path.join(confdir, 'conf.py'), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class SphinxPool(object):
+    """Bounded LRU pool of Sphinx applications.
+
+    Applications are keyed by source folder, language, builder and digest
+    of the configuration file, so an application is never reused once its
+    ``conf.py`` changed.
+    """
+
+    def __init__(self, size=4):
+        self.size = size
+        self._apps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, srcdir, outdir, doctreedir, buildername, lang,
+            confoverrides=None):
+        """Return a warm application for the target, creating it if
+        needed."""
+        key = (srcdir, lang, buildername, config_digest(srcdir))
+        with self._lock:
+            app = self._apps.pop(key, None)
+            if app is not None and (
+                    app.outdir != os.path.abspath(outdir) or
+                    app.doctreedir != os.path.abspath(doctreedir)):
+                app = None
+            if app is None:
+                # applications of the same sources have a stale config
+                self._invalidate(srcdir)
+                _logger.info('Creating Sphinx application for %s', srcdir)
+                app = Sphinx(srcdir, srcdir, outdir, doctreedir, buildername,
+                             confoverrides=confoverrides)
+            self._apps[key] = app
+            while len(self._apps) > self.size:
+                self._apps.popitem(last=False)
+        return app
+
+    def invalidate(self, srcdir=None):
+        """Drop the applications of ``srcdir``, or all of them."""
+        with self._lock:
+            self._invalidate(srcdir)
+
+    def _invalidate(self, srcdir):
+        for key in list(self._apps):
+            if srcdir is None or key[0] == srcdir:
+                del self._apps[key]
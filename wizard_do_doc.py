@@ -22,18 +22,25 @@
 
 import base64
 import glob
+import hashlib
+import json
 import logging
 import os
 import shutil
-import tempfile
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
-from git import Repo
 from jinja2 import Template
 from path import path
-from sphinx.application import Sphinx
 
-from openerp import models, fields, api, _, conf
-from openerp.modules.graph import Graph
+from openerp import models, fields, api, _, tools
+
+from . import blob_store, compress, git_mirror, pdf_builds, publishing
+from .sphinx_pool import SphinxPool
+from ._extensions import dochelp_search, odoodoc
+from ._extensions.odoodoc.lookup import LOOKUP_FILENAME, merge_lookups
 
 _logger = logging.getLogger(__name__)
 
@@ -47,7 +54,77 @@ BUILD_FMT = [
     ('latex', 'LaText')
 ]
 
-_sphinx_app = None
+# Odoo language of the metadata shown in each build language
+ODOO_LANG = {
+    'es': 'es_ES',
+    'ca': 'ca_ES',
+}
+
+# Base documentation repository, overridable with the
+# dochelp.doc_repo_url and dochelp.doc_repo_branch system parameters
+DOC_REPO_URL = '/home/jaume.planas/gitremote'
+DOC_REPO_BRANCH = '8.0'
+# Checkouts of the base documentation unused for longer are removed
+CHECKOUT_MAX_AGE = 30 * 24 * 3600
+
+# Warm Sphinx applications of the last built targets
+SPHINX_POOL_SIZE = 4
+
+_sphinx_pool = SphinxPool(size=SPHINX_POOL_SIZE)
+
+
+def get_data_path(*parts):
+    """Return a path inside the dochelp folder of the Odoo data dir."""
+    return os.path.join(tools.config['data_dir'], 'dochelp', *parts)
+
+
+def get_blob_store():
+    """Return the store the builds are shared with the other nodes through,
+    set with the dochelp_blob_store option of the server, or None."""
+    root = tools.config.get('dochelp_blob_store')
+    return blob_store.BlobStore(root) if root else None
+
+
+def get_pdf_cache(dbname, lang):
+    """Return the cache of the PDFs of the modules of a database in
+    ``lang``."""
+    return pdf_builds.PdfCache(get_data_path(dbname, 'pdf', lang))
+
+
+def tree_fingerprint(folder):
+    """Return a digest of the names, sizes and modification times of the
+    files of ``folder``, which changes whenever one of them does."""
+    digest = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(folder, followlinks=True):
+        dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+        for name in sorted(filenames):
+            if name.endswith('.pyc'):
+                continue
+            filename = os.path.join(dirpath, name)
+            stat = os.stat(filename)
+            digest.update(('%s\0%d\0%d\n' % (
+                os.path.relpath(filename, folder), stat.st_size,
+                stat.st_mtime)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_if_changed(filename, content):
+    """Write ``content`` to ``filename`` unless it already holds it, so
+    that Sphinx does not take the file for a changed one."""
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as f:
+            if f.read() == content:
+                return False
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return True
+
+
+def sharded_builds(env):
+    """Whether HTML builds are split into a Sphinx project per module, as
+    set with the dochelp.sharded_build system parameter."""
+    value = env['ir.config_parameter'].get_param('dochelp.sharded_build', '')
+    return value.lower() in ('1', 'true')
 
 
 class DochelpWizardDoc(models.TransientModel):
@@ -57,6 +134,10 @@ class DochelpWizardDoc(models.TransientModel):
     _dochelp_template = False
     _build_folder = False
     _output_folder = False
+    _job = False
+    _timings = False
+    _shards = False
+    _pdf_module = False
 
     build_lang = fields.Selection(string="Lang", required=True, default='es',
                                   selection=BUILD_LANG)
@@ -65,7 +146,9 @@ class DochelpWizardDoc(models.TransientModel):
     odoo_server = fields.Char(string="Server URL", required=True)
     odoo_db = fields.Char(string="Database Name", required=True)
     odoo_user = fields.Char(string="User", required=True)
-    odoo_pwd = fields.Char(string="Password", required=True)
+    odoo_pwd = fields.Char(string="Password",
+                           help="Only needed to rebuild the generated "
+                                "configuration outside of Odoo.")
 
     @api.model
     def default_get(self, fields_list):
@@ -80,18 +163,164 @@ class DochelpWizardDoc(models.TransientModel):
 
     @api.multi
     def do_build(self):
+        """Queue the build and show its job, which runs in the background."""
         self.ensure_one()
+        job = self.env['dochelp.build.job'].enqueue(self.build_lang,
+                                                    self.build_fmt)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'dochelp.build.job',
+            'res_id': job.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
+    @api.multi
+    def do_build_all(self):
+        """Queue the builds of every language in every format."""
+        self.ensure_one()
+        jobs = self.env['dochelp.build.job']
+        for build_lang, __ in BUILD_LANG:
+            for build_fmt, __ in BUILD_FMT:
+                jobs |= jobs.enqueue(build_lang, build_fmt)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Documentation builds'),
+            'res_model': 'dochelp.build.job',
+            'domain': [('id', 'in', jobs.ids)],
+            'view_mode': 'tree,form',
+            'target': 'current',
+        }
+
+    @api.multi
+    def run_build(self, job=None):
+        """Build the documentation, reporting the progress on ``job``."""
+        self.prepare_build(job=job)
+        with self.timed('sphinx'):
+            self.make_doc()
+        self.finish_build()
+
+    @api.multi
+    def prepare_build(self, job=None):
+        """Prepare the sources and the configuration of the build."""
+        self.ensure_one()
+        self._job = job
+        self._timings = OrderedDict()
         # self.get_config_values()
-        self._dochelp_path = os.path.join(tempfile.mkdtemp(), 'innubo_doc')
+        # The workspace of a target is kept between builds so that Sphinx
+        # only reads and writes again the documents that changed.
+        workspace = self.get_workspace()
+        self._dochelp_path = os.path.join(workspace, 'innubo_doc')
         self._dochelp_template = os.path.join(os.path.dirname(__file__),
                                               'conf.py.template')
-        self._build_folder = tempfile.mkdtemp()
-        self._output_folder = os.path.join(os.path.dirname(__file__), 'build',
-                                           self.build_fmt)
+        # the base documentation of a sharded build is a project of its own
+        self._build_folder = os.path.join(
+            workspace, 'main' if self.is_sharded() else 'src')
+        self._shards = OrderedDict() if self.is_sharded() else False
+        if not os.path.isdir(self._build_folder):
+            os.makedirs(self._build_folder)
+        if self.build_fmt == 'html':
+            # written aside and published as a whole once built, so that
+            # the served pages never belong to a partial build
+            self._output_folder = os.path.join(workspace, 'output')
+        else:
+            self._output_folder = self.get_publish_folder()
         _logger.info(self._build_folder)
-        self.update_odoo_doc()
-        self.fill_build_content()
-        self.make_doc()
+        self.report_phase('checkout')
+        with self.timed('update_odoo_doc'):
+            self.update_odoo_doc()
+        self.report_phase('prepare')
+        with self.timed('fill_build_content'):
+            self.fill_build_content()
+        with self.timed('build_config_file'):
+            self.build_config_file()
+
+    def get_workspace(self):
+        return get_data_path(self.env.cr.dbname, 'workspace',
+                             self.build_lang, self.build_fmt)
+
+    def get_publish_folder(self):
+        """Return the folder the documentation is served from."""
+        return os.path.join(os.path.dirname(__file__), 'build',
+                            self.build_lang, self.build_fmt)
+
+    def get_pdf_folder(self, module=None):
+        """Return the folder of the LaTeX projects of the PDFs of the
+        modules, or the one of ``module``."""
+        folder = get_data_path(self.env.cr.dbname, 'workspace',
+                               self.build_lang, 'pdf')
+        return os.path.join(folder, module) if module else folder
+
+    def get_pdf_cache(self):
+        return get_pdf_cache(self.env.cr.dbname, self.build_lang)
+
+    def get_cache_path(self):
+        return get_data_path(self.env.cr.dbname, 'metadata.sqlite')
+
+    def is_sharded(self):
+        return self.build_fmt == 'html' and sharded_builds(self.env)
+
+    def get_shard_folder(self, module):
+        """Return the folder of the Sphinx project of the documentation of
+        ``module`` in a sharded build."""
+        return os.path.join(self.get_workspace(), 'shards', module)
+
+    def get_shards(self):
+        """Return the modules built as shards, in dependency order, with
+        the ones their documentation links to."""
+        return self._shards or OrderedDict()
+
+    def report_phase(self, phase):
+        if self._job:
+            self._job._report(phase=phase)
+
+    @contextmanager
+    def timed(self, name):
+        """Record the time spent in a step of the build for its report."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.time() - start)
+
+    def add_timing(self, name, seconds):
+        self._timings[name] = round(seconds, 3)
+
+    def build_report(self):
+        """Return the report of the build as JSON, with the timings of its
+        steps and the profiles written by the odoodoc extension."""
+        target = '%s/%s' % (self.build_lang, self.build_fmt)
+        if self._pdf_module:
+            # the report of the full build is kept
+            target = '%s/pdf/%s' % (self.build_lang, self._pdf_module)
+            folder = self.get_pdf_folder(self._pdf_module)
+        else:
+            folder = self.get_workspace()
+        report = OrderedDict([
+            ('target', target),
+            ('steps', self._timings),
+        ])
+        profile = self.read_profile(self._build_folder)
+        if profile:
+            report['sphinx'] = profile
+        for module in self.get_shards():
+            profile = self.read_profile(self.get_shard_folder(module))
+            if profile:
+                report.setdefault('shards', OrderedDict())[module] = profile
+        report = json.dumps(report, indent=2)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, 'build_report.json'), 'w') as f:
+            f.write(report)
+        return report
+
+    def read_profile(self, confdir):
+        """Return the profile of the last Sphinx build of ``confdir``."""
+        profile = os.path.join(confdir, '.doctrees', odoodoc.PROFILE_FILENAME)
+        if os.path.isfile(profile):
+            with open(profile) as f:
+                return json.load(f)
+        return None
 
     # def get_config_values(self):
     #     # TODO ConfigParser, read paths and modules from modules.cfg
@@ -103,23 +332,66 @@ class DochelpWizardDoc(models.TransientModel):
         # src_dir = '/home/jaume.planas/customer_docs/odoodoc_doc/'
         # trg_dir = self._doc_path
         # subprocess.check_output(['rsync', '-r', '--del', src_dir, trg_dir])
-        q = Repo.clone_from('/home/jaume.planas/gitremote', self._dochelp_path)
-        q.git.checkout('8.0')
+        params = self.env['ir.config_parameter']
+        url = params.get_param('dochelp.doc_repo_url', DOC_REPO_URL)
+        branch = params.get_param('dochelp.doc_repo_branch', DOC_REPO_BRANCH)
+        repo = git_mirror.update_mirror(
+            url, git_mirror.mirror_path(get_data_path('mirrors'), url))
+        # git only rewrites the files that differ, so the unchanged sources
+        # keep their mtime and Sphinx does not read them again
+        commit = git_mirror.checkout(repo, self._dochelp_path, branch)
+        _logger.info('Base documentation at %s %s', branch, commit)
+        git_mirror.collect_garbage(repo, CHECKOUT_MAX_AGE)
+
+    def get_module_docs(self):
+        """Return the documentation folders of the installed modules in the
+        language of the build, in dependency order."""
+        return self.env['dochelp.module.doc'].search(
+            [('lang', '=', self.build_lang)])
 
     def get_documentation_modules(self):
-        modules = self.env['ir.module.module'].search([('state', '=', 'installed')])
-        graph = Graph()
-        graph.add_modules(self._cr, [m.name for m in modules])
-        mods = [m.name for m in graph]
-        mods.reverse()
-        return mods
+        return self.get_module_docs().mapped('name')[::-1]
+
+    def get_module_dependencies(self, modules):
+        """Return the installed modules each of ``modules`` depends on,
+        directly or not."""
+        direct = {}
+        for module in self.env['ir.module.module'].search(
+                [('state', '=', 'installed')]):
+            direct[module.name] = [dep.name for dep in module.dependencies_id]
+        upstream = {}
+
+        def collect(name):
+            if name not in upstream:
+                upstream[name] = set()
+                for dep in direct.get(name, ()):
+                    upstream[name] |= collect(dep) | {dep}
+            return upstream[name]
+
+        return dict((name, collect(name)) for name in modules)
 
     def build_config_file(self):
         with open(self._dochelp_template) as f:
             template = Template(f.read())
+        vals = self.get_config_template_context()
         config_file = os.path.join(self._build_folder, 'conf.py')
         with open(config_file, 'w') as f:
-            f.write(template.render(**self.get_config_template_context()))
+            f.write(template.render(**vals))
+        for module, deps in self.get_shards().items():
+            # shards link to the base documentation and to the shards of
+            # the modules they depend on through their inventories, with
+            # absolute URLs as Sphinx mangles relative ones
+            url = '/dochelp/%s' % self.build_lang
+            intersphinx = {'main': (url, os.path.join(self._output_folder,
+                                                      'objects.inv'))}
+            for dep in deps:
+                intersphinx[dep] = ('%s/%s' % (url, dep), os.path.join(
+                    self._output_folder, dep, 'objects.inv'))
+            vals['INTERSPHINX'] = intersphinx
+            config_file = os.path.join(self.get_shard_folder(module),
+                                       'conf.py')
+            with open(config_file, 'w') as f:
+                f.write(template.render(**vals))
 
     def get_config_template_context(self):
         vals = {
@@ -129,7 +401,10 @@ class DochelpWizardDoc(models.TransientModel):
             'ODOO_SERVER': self.odoo_server,
             'ODOO_DB': self.odoo_db,
             'ODOO_USER': self.odoo_user,
-            'ODOO_PWD': self.odoo_pwd
+            'ODOO_PWD': self.odoo_pwd,
+            'CACHE_PATH': self.get_cache_path(),
+            'LANGUAGE': self.build_lang,
+            'ODOO_LANG': ODOO_LANG[self.build_lang],
         }
         logo_dir = 'None'
         company = False
@@ -137,11 +412,15 @@ class DochelpWizardDoc(models.TransientModel):
         if company_id:
             company = self.env['res.company'].browse(company_id)
         if company and company.logo:
-            buffer = base64.b64decode(company.logo)
             logo_dir = os.path.join(self._build_folder, '_static', 'customer_logo.png')
-            f = open(logo_dir, mode='w')
-            f.write(buffer)
-            f.close()
+            # decoded and rewritten only when it changed, so that Sphinx
+            # does not copy it again to every build
+            digest = hashlib.sha1(company.logo).hexdigest()
+            stamp = os.path.join(self._build_folder, 'customer_logo.digest')
+            if write_if_changed(stamp, digest) or \
+                    not os.path.isfile(logo_dir):
+                with open(logo_dir, 'wb') as f:
+                    f.write(base64.b64decode(company.logo))
         vals.update({
             'CUSTOMER_LOGO': logo_dir,
         })
@@ -149,48 +428,306 @@ class DochelpWizardDoc(models.TransientModel):
 
     def fill_build_content(self):
         self.create_symlinks(self._dochelp_path)
-        for module_dir in conf.addons_paths:
-            self.create_symlinks(module_dir)
+        if not self.is_sharded():
+            for doc in self.get_module_docs():
+                self.make_link(doc.path,
+                               os.path.join(self._build_folder, doc.name))
         index = os.path.join(self._dochelp_path, 'index.rst')
         link = os.path.join(self._build_folder, 'index.rst')
         self.make_link(index, link)
         local_dir = os.path.dirname(__file__)
-        build_dir_extensions = os.path.join(self._build_folder, '_extensions')
-        if os.path.exists(build_dir_extensions):
-            shutil.rmtree(build_dir_extensions)
-        shutil.copytree(
-            os.path.join(local_dir, '_extensions'),
-            build_dir_extensions
-        )
-        build_dir_static = os.path.join(self._build_folder, '_static')
-        if os.path.exists(build_dir_static):
-            shutil.rmtree(build_dir_static)
-        shutil.copytree(
-            os.path.join(local_dir, '_static'),
-            build_dir_static
-        )
+        for name in ('_extensions', '_static'):
+            self.copy_folder(os.path.join(local_dir, name),
+                             os.path.join(self._build_folder, name))
+        if self.is_sharded():
+            self.fill_shards()
+
+    def copy_folder(self, origin, destination):
+        """Copy ``origin`` to ``destination``, unless it did not change
+        since the last copy."""
+        fingerprint = tree_fingerprint(origin)
+        stamp = destination + '.fingerprint'
+        if os.path.isdir(destination) and os.path.isfile(stamp):
+            with open(stamp) as f:
+                if f.read() == fingerprint:
+                    return
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+        shutil.copytree(origin, destination,
+                        ignore=shutil.ignore_patterns('*.pyc', '__pycache__'))
+        with open(stamp, 'w') as f:
+            f.write(fingerprint)
+
+    def fill_shards(self):
+        """Prepare a Sphinx project for the documentation of every installed
+        module, sharing the extensions and static files of the base one,
+        and a page of the base documentation linking to them."""
+        doc_dirs = OrderedDict(
+            (doc.name, doc.path) for doc in self.get_module_docs()
+            if os.path.isfile(os.path.join(doc.path, 'index.rst')))
+        dependencies = self.get_module_dependencies(doc_dirs)
+        self._shards.clear()
+        for module_name in doc_dirs:
+            folder = self.get_shard_folder(module_name)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            self.make_link(doc_dirs[module_name], os.path.join(folder, 'src'))
+            for name in ('_extensions', '_static'):
+                self.make_link(os.path.join(self._build_folder, name),
+                               os.path.join(folder, name))
+            self._shards[module_name] = sorted(
+                dependencies[module_name] & set(doc_dirs))
+        lines = [':orphan:', '', 'Modules', '=======', '']
+        lines.extend('* `%s <%s/index.html>`_' % (module_name, module_name)
+                     for module_name in sorted(self._shards))
+        content = '\n'.join(lines) + '\n'
+        write_if_changed(os.path.join(self._build_folder, 'modules.rst'),
+                         content.encode('utf-8'))
 
     def create_symlinks(self, origin):
         for module_doc_dir in glob.glob('%s/*/doc/%s' % (origin, self.build_lang)):
             module_name = str(path(module_doc_dir).parent.parent.basename())
             symlink = path(self._build_folder).joinpath(module_name)
+            if symlink.islink() and not symlink.exists():
+                # dangling link left by a previous build
+                symlink.remove()
             if not symlink.exists():
                 path(self._build_folder).relpathto(
                     path(module_doc_dir)).symlink(symlink)
 
     def make_link(self, origin, destination):
         directory = os.path.dirname(destination)
+        if os.path.islink(destination) and not os.path.exists(destination):
+            os.remove(destination)
         if not os.path.exists(destination):
             path(directory).relpathto(path(origin)).symlink(destination)
 
     def make_doc(self):
-        global _sphinx_app
         dest = self._output_folder
         doctree_dir = os.path.join(self._build_folder, '.doctrees')
-        self.build_config_file()
-        # We must cache sphinx instance otherwise extensions are loaded
-        # multiple times and duplicated references errors are raised.
-        if _sphinx_app is None:
-            _sphinx_app = Sphinx(
-                self._build_folder, self._build_folder, dest, doctree_dir, self.build_fmt)
-        _sphinx_app.build(force_all=True)
+        env = self.env
+
+        # Read the metadata from this very registry instead of calling the
+        # server back over XML-RPC.  A function is used because Sphinx
+        # leaves functions out of the pickled environment.
+        def odoodoc_backend(app):
+            return odoodoc.EnvBackend(env)
+
+        # Sphinx applications are cached so that extensions are not loaded
+        # again on every build.
+        app = _sphinx_pool.get(
+            self._build_folder, dest, doctree_dir, self.build_fmt,
+            self.build_lang,
+            confoverrides={'odoodoc_backend': odoodoc_backend})
+        app.config.odoodoc_backend = odoodoc_backend
+        listeners = []
+        if self._job:
+            listeners = self._job.connect_progress(app)
+        try:
+            app.build(force_all=False)
+        finally:
+            for listener in listeners:
+                app.disconnect(listener)
+
+    def finish_build(self):
+        """Post-process the output of a successful build."""
+        if self.build_fmt == 'html':
+            # pages are sent compressed without compressing them on
+            # every request
+            self.report_phase('finish')
+            with self.timed('precompress'):
+                compress.precompress(self._output_folder)
+            target = self.get_publish_folder()
+            store = get_blob_store()
+            store_target = '%s/%s' % (self.build_lang, self.build_fmt)
+            with self.timed('publish'):
+                generation = publishing.publish_generation(
+                    self._output_folder, target,
+                    os.path.dirname(os.path.dirname(target)),
+                    minimum=store and store.current(store_target) or 0)
+            if store:
+                # lets the other nodes serve the new generation
+                with self.timed('store'):
+                    blob_store.push_generation(
+                        store, store_target, os.path.join(
+                            publishing.generations_folder(target),
+                            str(generation)), generation)
+                    store.collect()
+        elif self.build_fmt == 'latex':
+            self.report_phase('finish')
+            with self.timed('pdf'):
+                self.build_module_pdfs()
+
+    def prepare_module_pdfs(self, docs):
+        """Prepare the LaTeX project of the documentation of each module
+        of ``docs`` and return the tasks building their PDFs.
+
+        The projects share the extensions and static files, and each PDF
+        is keyed by its configuration, its sources, the shared files and
+        the metadata they reference, which is stored in the persistent
+        cache for the Sphinx processes to read it from there.
+        """
+        folder = self.get_pdf_folder()
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        local_dir = os.path.dirname(__file__)
+        with open(os.path.join(local_dir, 'conf.py.template')) as f:
+            template = Template(f.read())
+        backend = odoodoc.EnvBackend(self.env)
+        odoo_lang = ODOO_LANG[self.build_lang]
+        titles = dict(
+            (module.name, module.shortdesc) for module in
+            self.env['ir.module.module'].with_context(
+                lang=ODOO_LANG[self.build_lang]).search(
+                [('name', 'in', docs.mapped('name'))]))
+        tasks = []
+        with pdf_builds.locked(folder + '.lock'):
+            shared = []
+            for name in ('_extensions', '_static'):
+                self.copy_folder(os.path.join(local_dir, name),
+                                 os.path.join(folder, name))
+            # the customer logo is written in the shared static files
+            build_folder, self._build_folder = self._build_folder, folder
+            try:
+                vals = self.get_config_template_context()
+            finally:
+                self._build_folder = build_folder
+            for name in ('_extensions', '_static'):
+                shared.append(tree_fingerprint(os.path.join(folder, name)))
+            for doc in docs:
+                if not os.path.isfile(os.path.join(doc.path, 'index.rst')):
+                    continue
+                project = self.get_pdf_folder(doc.name)
+                if not os.path.isdir(project):
+                    os.makedirs(project)
+                self.make_link(doc.path, os.path.join(project, 'src'))
+                for name in ('_extensions', '_static'):
+                    self.make_link(os.path.join(folder, name),
+                                   os.path.join(project, name))
+                vals.update({
+                    'PDF_MODULE': doc.name,
+                    'PDF_TITLE': repr(titles.get(doc.name) or doc.name),
+                })
+                conf = template.render(**vals)
+                write_if_changed(os.path.join(project, 'conf.py'),
+                                 conf.encode('utf-8'))
+                signature = odoodoc.warm_cache(backend, self.get_cache_path(),
+                                               doc.path, odoo_lang)
+                key = pdf_builds.pdf_key(
+                    conf, doc.fingerprint, odoodoc.metadata_digest(
+                        self.get_cache_path(), doc.path, odoo_lang,
+                        signature), *shared)
+                tasks.append(pdf_builds.PdfTask(
+                    doc.name, key, self.get_pdf_commands(doc.name, signature),
+                    os.path.join(project, 'latex', '%s.pdf' % doc.name),
+                    self.get_log_path(pdf=doc.name)))
+        return tasks
+
+    def build_module_pdfs(self, docs=None):
+        """Build the PDFs of the documentation of ``docs``, all the
+        installed modules by default, that are not cached yet, in
+        parallel, and return the PDF of each module by name."""
+        cache = self.get_pdf_cache()
+        if docs is None:
+            docs = self.get_module_docs()
+            # PDFs of the modules uninstalled since the last build
+            cache.collect(docs.mapped('name'))
+        return pdf_builds.build_pdfs(cache, self.prepare_module_pdfs(docs))
+
+    @api.multi
+    def run_module_pdf(self, module, job=None):
+        """Build the PDF of the documentation of ``module`` only, reporting
+        on ``job``."""
+        self.ensure_one()
+        self._job = job
+        self._timings = OrderedDict()
+        self._pdf_module = module
+        self._build_folder = self.get_pdf_folder(module)
+        self.report_phase('prepare')
+        docs = self.get_module_docs().filtered(lambda doc: doc.name == module)
+        with self.timed('pdf'):
+            self.build_module_pdfs(docs)
+
+    def merge_shards(self):
+        """Merge the search indexes and lookup tables of the shards into the
+        ones of the base documentation, so that the site is searched and
+        looked up as a whole."""
+        projects = [('', self._build_folder, self._output_folder)]
+        projects.extend(('%s/' % module, self.get_shard_folder(module),
+                         os.path.join(self._output_folder, module))
+                        for module in self.get_shards())
+        # the indexes are read from the doctree folders, as the published
+        # one of the base documentation is replaced by the merged one
+        dochelp_search.merge_indexes(
+            os.path.join(self._output_folder, dochelp_search.INDEX_FILENAME),
+            [(prefix, os.path.join(confdir, '.doctrees',
+                                   dochelp_search.WRITER_FILENAME))
+             for prefix, confdir, outdir in projects])
+        merge_lookups(os.path.join(self._output_folder, LOOKUP_FILENAME),
+                      [(prefix, os.path.join(outdir, LOOKUP_FILENAME))
+                       for prefix, confdir, outdir in projects])
+
+    def warm_metadata_cache(self):
+        """Store the metadata referenced by the prepared sources in the
+        persistent cache and return the signature to read it with."""
+        backend = odoodoc.EnvBackend(self.env)
+        folders = [self._build_folder]
+        if self.get_shards():
+            folders.append(os.path.join(self.get_workspace(), 'shards'))
+        for folder in folders:
+            signature = odoodoc.warm_cache(backend, self.get_cache_path(),
+                                           folder, ODOO_LANG[self.build_lang])
+        return signature
+
+    def get_sphinx_command(self, signature, shard=None):
+        """Return the command running the prepared build, or the one of the
+        shard of module ``shard``, in a process of its own, with the
+        metadata read from the persistent cache."""
+        if shard:
+            confdir = self.get_shard_folder(shard)
+            srcdir = os.path.join(confdir, 'src')
+            outdir = os.path.join(self._output_folder, shard)
+        else:
+            confdir = srcdir = self._build_folder
+            outdir = self._output_folder
+        return [
+            sys.executable, '-c',
+            'import sys; from sphinx import build_main; '
+            'sys.exit(build_main(sys.argv))',
+            '-b', self.build_fmt, '-N', '-c', confdir,
+            '-d', os.path.join(confdir, '.doctrees'),
+            '-D', 'odoodoc_backend=cache',
+            '-D', 'odoodoc_cache_signature=%s' % signature,
+            srcdir, outdir,
+        ]
+
+    def get_pdf_commands(self, module, signature):
+        """Return the commands building the PDF of the documentation of
+        ``module``, with their working directory: a Sphinx process writing
+        its LaTeX project, with the metadata read from the persistent
+        cache, and latexmk compiling it."""
+        confdir = self.get_pdf_folder(module)
+        outdir = os.path.join(confdir, 'latex')
+        sphinx = [
+            sys.executable, '-c',
+            'import sys; from sphinx import build_main; '
+            'sys.exit(build_main(sys.argv))',
+            '-b', 'latex', '-N', '-c', confdir,
+            '-d', os.path.join(confdir, '.doctrees'),
+            '-D', 'odoodoc_backend=cache',
+            '-D', 'odoodoc_cache_signature=%s' % signature,
+            os.path.join(confdir, 'src'), outdir,
+        ]
+        latexmk = pdf_builds.LATEXMK_COMMAND + ['%s.tex' % module]
+        return [(sphinx, confdir), (latexmk, outdir)]
+
+    def get_log_path(self, shard=None, pdf=None):
+        """Return the file the output of a Sphinx process is logged to,
+        or the one of the build of the PDF of module ``pdf``."""
+        if pdf:
+            folder = self.get_pdf_folder(pdf)
+        elif shard:
+            folder = self.get_shard_folder(shard)
+        else:
+            folder = self.get_workspace()
+        return os.path.join(folder, 'build.log')